@@ -1,23 +1,62 @@
 import os
 import time
+import json
+import csv
 from dotenv import load_dotenv
 from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
+from playwright.async_api import async_playwright, Page as AsyncPage
 import logging
 import pyttsx3
 import re
 import requests
 from together import Together
 import difflib
+import zlib
+import numpy as np
 from difflib import get_close_matches
 import speech_recognition as sr
 import uuid
+from urllib.parse import urlparse, urljoin
+import fnmatch
 import tkinter as tk
 import threading
+import random
+import concurrent.futures
+import asyncio
+import contextvars
+import inspect
+import collections
+import queue
+import subprocess
+import tempfile
+import hashlib
+import gzip
+import sys
+import cProfile
+import pstats
+import io
+import wave
 from tkinter import PhotoImage
 import base64
 from io import BytesIO
 from PIL import Image, ImageTk
 
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import sounddevice as sd
+except (ImportError, OSError):
+    # OSError: the PortAudio library itself is missing
+    sd = None
+
+try:
+    from flask import Flask, Response, jsonify, request
+except ImportError:
+    Flask = None
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s'
@@ -33,17 +72,166 @@ logger.info(f"Together API key found: {'Yes' if api_key else 'No'}")
 if not api_key:
     raise Exception("❌ TOGETHER_API_KEY not found in environment.env file!")
 
-# Initialize Together client
-client = Together(api_key=api_key)
+# LLM gateway settings: per-call deadline, retries, rate limit and circuit breaker.
+# TOGETHER_BASE_URL can point the client at a local fake server for testing.
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "20"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+LLM_RATE_PER_SEC = float(os.getenv("LLM_RATE_PER_SEC", "2"))
+LLM_BURST = int(os.getenv("LLM_BURST", "4"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+# Calls given up on (deadline, cancel) keep running until the client returns; this many
+# may linger in extra workers before new calls are refused instead of queued behind them
+LLM_MAX_ABANDONED = int(os.getenv("LLM_MAX_ABANDONED", "4"))
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "3"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+# Per-command latency budgets in seconds. Override one with COMMAND_BUDGET_<TYPE>,
+# e.g. COMMAND_BUDGET_CLICK=6. "plan" covers a whole AI-planned command.
+COMMAND_BUDGETS = {
+    "open": 20, "search": 8, "login": 10, "type": 10, "click": 10, "play": 10,
+    "scroll": 3, "extract": 60, "plan": 45, "run": 120, "default": 10,
+}
+for _kind in COMMAND_BUDGETS:
+    COMMAND_BUDGETS[_kind] = float(os.getenv(f"COMMAND_BUDGET_{_kind.upper()}", COMMAND_BUDGETS[_kind]))
+
+# Initialize Together client (retries are handled by the gateway below)
+client = Together(api_key=api_key, base_url=os.getenv("TOGETHER_BASE_URL"), timeout=LLM_TIMEOUT, max_retries=0)
 MODEL = "mistralai/Mixtral-8x7B-Instruct-v0.1"
 
+# Task routes: each call type gets its own model, max_tokens and timeout.
+# Override with LLM_MODEL_<ROUTE>, LLM_MAX_TOKENS_<ROUTE>, LLM_TIMEOUT_<ROUTE>.
+LLM_ROUTES = {
+    "selector": {"model": MODEL, "max_tokens": 200, "timeout": LLM_TIMEOUT},
+    "plan": {"model": MODEL, "max_tokens": 300, "timeout": LLM_TIMEOUT},
+    "summarize": {"model": MODEL, "max_tokens": 150, "timeout": LLM_TIMEOUT},
+    "extract": {"model": MODEL, "max_tokens": 200, "timeout": LLM_TIMEOUT},
+}
+for _route, _cfg in LLM_ROUTES.items():
+    _cfg["model"] = os.getenv(f"LLM_MODEL_{_route.upper()}", _cfg["model"])
+    _cfg["max_tokens"] = int(os.getenv(f"LLM_MAX_TOKENS_{_route.upper()}", _cfg["max_tokens"]))
+    _cfg["timeout"] = float(os.getenv(f"LLM_TIMEOUT_{_route.upper()}", _cfg["timeout"]))
+
+# Structural extraction settings (tables / repeated cards)
+EXTRACT_DIR = os.getenv("EXTRACT_DIR", "extracts")
+EXTRACT_FORMAT = os.getenv("EXTRACT_FORMAT", "jsonl").lower()
+EXTRACT_MAX_PAGES = int(os.getenv("EXTRACT_MAX_PAGES", "5"))
+EXTRACT_MIN_REPEAT = int(os.getenv("EXTRACT_MIN_REPEAT", "3"))
+# How long a "next" click in a single-page app may take to swap in the next rows
+EXTRACT_NEXT_WAIT_MS = int(os.getenv("EXTRACT_NEXT_WAIT_MS", "5000"))
+
+# Text input mode: "fill" sets the value in one call, "type" clears and sends one
+# key event per character, "paced" does the same with TYPE_DELAY_MS between keys.
+# Hosts in TYPE_SITES (comma separated) always get KEY_EVENT_MODE.
+INPUT_MODE = os.getenv("INPUT_MODE", "fill").lower()
+KEY_EVENT_MODE = os.getenv("KEY_EVENT_MODE", "paced").lower()
+TYPE_DELAY_MS = int(os.getenv("TYPE_DELAY_MS", "30"))
+TYPE_SITES = [h.strip().lower() for h in os.getenv("TYPE_SITES", "").split(",") if h.strip()]
+
+# Browser: "launch" starts a private Chromium per process; "shared" connects to one
+# local Chromium (started on first use) over CDP, or to BROWSER_WS_ENDPOINT if set
+# (e.g. a Playwright run-server / launch_server endpoint). Each process gets its own context.
+BROWSER_MODE = os.getenv("BROWSER_MODE", "launch").lower()
+BROWSER_WS_ENDPOINT = os.getenv("BROWSER_WS_ENDPOINT")
+BROWSER_CDP_PORT = int(os.getenv("BROWSER_CDP_PORT", "9222"))
+BROWSER_HEADLESS = os.getenv("BROWSER_HEADLESS", "0") == "1"
+BROWSER_RECONNECT_ATTEMPTS = int(os.getenv("BROWSER_RECONNECT_ATTEMPTS", "5"))
+
+# Command engine: "sync" (default) or "async" (playwright.async_api on one event loop)
+BOT_ENGINE = os.getenv("BOT_ENGINE", "sync").lower()
+
+# Debug artifacts for failed lookups: a viewport JPEG and gzipped HTML written by a
+# background thread into DEBUG_DIR, keeping at most DEBUG_MAX_FILES files / DEBUG_MAX_MB.
+# DEBUG_TRACE=1 records a Playwright trace per session ("start tracing" / "stop tracing").
+DEBUG_CAPTURE = os.getenv("DEBUG_CAPTURE", "1") == "1"
+DEBUG_DIR = os.getenv("DEBUG_DIR", "debug")
+DEBUG_MAX_FILES = int(os.getenv("DEBUG_MAX_FILES", "100"))
+DEBUG_MAX_MB = float(os.getenv("DEBUG_MAX_MB", "100"))
+DEBUG_JPEG_QUALITY = int(os.getenv("DEBUG_JPEG_QUALITY", "60"))
+DEBUG_TRACE = os.getenv("DEBUG_TRACE", "0") == "1"
+
+# Profiling: PROFILE_MODE=cprofile (deterministic) or sample (a thread sampling the stack
+# every PROFILE_INTERVAL_MS) wraps each command and writes one file per command into
+# PROFILE_DIR plus an aggregated hot-function report when the bot exits.
+PROFILE_MODE = os.getenv("PROFILE_MODE", "off").lower()
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", "30"))
+
+# Spoken feedback: fixed phrases are rendered to WAV once (in TTS_CACHE_DIR) and kept
+# decoded in memory; short templated phrases ("Clicked {target}") go to an LRU of TTS_CACHE_SIZE.
+TTS_CACHE = os.getenv("TTS_CACHE", "1") == "1"
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "tts_cache")
+TTS_CACHE_SIZE = int(os.getenv("TTS_CACHE_SIZE", "64"))
+TTS_CACHE_MAX_CHARS = int(os.getenv("TTS_CACHE_MAX_CHARS", "80"))
+
+# Local control API (off unless CONTROL_API_PORT or CONTROL_API_ONLY is set). Each session has its own
+# browser context, worker thread and a command queue of CONTROL_QUEUE_SIZE.
+CONTROL_API_HOST = os.getenv("CONTROL_API_HOST", "127.0.0.1")
+CONTROL_API_PORT = int(os.getenv("CONTROL_API_PORT", "0"))
+CONTROL_API_TOKEN = os.getenv("CONTROL_API_TOKEN")
+CONTROL_API_ONLY = os.getenv("CONTROL_API_ONLY", "0") == "1"
+CONTROL_MAX_SESSIONS = int(os.getenv("CONTROL_MAX_SESSIONS", "4"))
+CONTROL_QUEUE_SIZE = int(os.getenv("CONTROL_QUEUE_SIZE", "20"))
+CONTROL_EVENT_BUFFER = int(os.getenv("CONTROL_EVENT_BUFFER", "200"))
+
+# Opt-in capture of JSON search results: responses whose URL matches one of these glob
+# patterns (comma separated, e.g. "*/api/search*,*graphql*") are parsed for title/url
+# records that "click item" and "extract" use before scanning the DOM.
+CAPTURE_RESPONSES = [p.strip() for p in os.getenv("CAPTURE_RESPONSES", "").split(",") if p.strip()]
+CAPTURE_MAX_ITEMS = int(os.getenv("CAPTURE_MAX_ITEMS", "500"))
+CAPTURE_MAX_BYTES = int(os.getenv("CAPTURE_MAX_BYTES", str(4 * 1048576)))
+# SPAs often fetch results just before pushState; records this recent survive the URL change
+CAPTURE_NAV_GRACE = float(os.getenv("CAPTURE_NAV_GRACE", "1.0"))
+# "extract <target>" uses captured records only when the target asks for the results themselves
+RESULT_TARGET_WORDS = re.compile(
+    r"\b(results?|items?|listings?|products?|entries|rows|list|lists|matches|hits|search|all|everything)\b", re.I)
+
+# "click item" on long or infinite lists scrolls in steps, indexing only newly attached
+# elements, until the item is found or these limits / the command budget are reached.
+SCROLL_HARVEST_MAX_STEPS = int(os.getenv("SCROLL_HARVEST_MAX_STEPS", "30"))
+SCROLL_HARVEST_MAX_ITEMS = int(os.getenv("SCROLL_HARVEST_MAX_ITEMS", "1000"))
+SCROLL_HARVEST_PAUSE_MS = int(os.getenv("SCROLL_HARVEST_PAUSE_MS", "400"))
+SCROLL_HARVEST_LOOSE_STEPS = int(os.getenv("SCROLL_HARVEST_LOOSE_STEPS", "2"))
+HARVEST_PENDING_CAP = 2000
+
+# AI selector fallbacks ask for this many ranked selectors and check them all in one
+# in-page call instead of waiting on a single guess.
+AI_SELECTOR_CANDIDATES = int(os.getenv("AI_SELECTOR_CANDIDATES", "5"))
+# Share of the target's letter pairs a click/play candidate's text or labels must contain
+AI_SELECTOR_MIN_AFFINITY = float(os.getenv("AI_SELECTOR_MIN_AFFINITY", "0.3"))
+
+# Live ElementHandles kept at most; older ones (and any from a previous page) are disposed
+MAX_LIVE_HANDLES = int(os.getenv("MAX_LIVE_HANDLES", "200"))
+
+# Recorded macros (name -> list of resolved steps). On replay each step waits up to
+# MACRO_STEP_WAIT_MS for its page and element before it counts as drifted.
+MACRO_FILE = os.getenv("MACRO_FILE", "macros.json")
+MACRO_STEP_WAIT_MS = int(os.getenv("MACRO_STEP_WAIT_MS", "3000"))
+
+# Local click-target ranking (hashed character n-gram TF-IDF)
+CLICK_RANK_MIN_SCORE = float(os.getenv("CLICK_RANK_MIN_SCORE", "0.6"))
+CLICK_RANK_MARGIN = float(os.getenv("CLICK_RANK_MARGIN", "0.1"))
+CLICK_RANK_DIM = 1 << 14
+
+# Listening: "continuous" captures speech in the background into a command queue so the
+# next command can be said while one runs; "turn" is the old listen-then-run loop.
+LISTEN_MODE = os.getenv("LISTEN_MODE", "continuous").lower()
+LISTEN_PHRASE_LIMIT = float(os.getenv("LISTEN_PHRASE_LIMIT", "8"))
+DISAMBIGUATION_TIMEOUT = float(os.getenv("DISAMBIGUATION_TIMEOUT", "8"))
+# "stop" is a cancel word only: a late barge-in "stop" must not end the bot
+EXIT_WORDS = ["exit", "quit", "bye"]
+# Said while a command runs, these cancel it (and anything queued behind it)
+CANCEL_WORDS = ["stop", "cancel", "never mind", "nevermind"]
+# Seconds after the bot stops talking during which captured audio is still its echo
+SPEECH_ECHO_TAIL = float(os.getenv("SPEECH_ECHO_TAIL", "0.5"))
+
 # Initialize speech recognition (from a.py logic)
+# BOT_AUDIO=0 runs without microphone or speech output (API-only hosts, soak runs)
+BOT_AUDIO = os.getenv("BOT_AUDIO", "1") == "1"
 recognizer = sr.Recognizer()
-microphone = sr.Microphone()
-
-# Track last action and last search results for context
-last_action = None
-last_search_results = []
+microphone = sr.Microphone() if BOT_AUDIO else None
 
 # Microphone icon as base64 PNG (simple black mic, 32x32)
 MIC_ICON_BASE64 = (
@@ -79,6 +267,475 @@ MIC_ICON_BASE64 = (
     "wQnCwQnCwQnCwQnCwQnCwQnCwQnCwQnCwQnCwQnCwQnCwQnCwQnCwQnCwQnCwQnCwQnCwQnC"
 )
 
+class LLMUnavailable(Exception):
+    """Raised when the LLM could not answer within its deadline or the circuit is open."""
+
+class CommandCancelled(BaseException):
+    """Raised at the next stage of a command the user cancelled. A BaseException, like
+    asyncio.CancelledError, so the cascades' "except Exception" fallbacks let it through
+    instead of trying the next strategy and speaking a failure."""
+
+class SecretUnavailable(Exception):
+    """Raised when a command needs a secret that its caller did not supply."""
+
+class TokenBucket:
+    """Thread-safe token bucket shared by every caller of the gateway."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, timeout):
+        """Wait for a token; returns False if none is available within timeout seconds."""
+        end = time.monotonic() + timeout
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate if self.rate > 0 else timeout
+            if time.monotonic() + wait > end:
+                return False
+            time.sleep(wait)
+
+class CircuitBreaker:
+    """Opens after consecutive failures and lets one trial call through after a cooldown."""
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def release_trial(self):
+        with self.lock:
+            self.trial_in_flight = False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_in_flight or self.failures >= self.threshold:
+                if self.opened_at is None or self.trial_in_flight:
+                    print(f"[LLM] Circuit opened after {self.failures} failures; skipping AI for {self.cooldown:.0f}s.")
+                self.opened_at = time.monotonic()
+            self.trial_in_flight = False
+
+def _is_retryable(exc):
+    if isinstance(exc, (concurrent.futures.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    status = getattr(exc, "http_status", None) or getattr(exc, "status_code", None)
+    if status:
+        return status == 429 or status >= 500
+    name = type(exc).__name__
+    return any(k in name for k in ("Timeout", "Connection", "RateLimit", "ServiceUnavailable", "APIError"))
+
+class RouteStats:
+    """Latency and token counters for one LLM route."""
+
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.latencies = collections.deque(maxlen=500)
+
+    def summary(self):
+        lat = sorted(self.latencies)
+        pct = lambda q: lat[min(len(lat) - 1, int(q * len(lat)))] if lat else 0.0
+        return {
+            "calls": self.calls, "failures": self.failures,
+            "p50_s": round(pct(0.5), 3), "p95_s": round(pct(0.95), 3),
+            "prompt_tokens": self.prompt_tokens, "completion_tokens": self.completion_tokens,
+        }
+
+class LLMGateway:
+    """Single entry point for chat completions with deadlines, jittered exponential
+    backoff, a shared rate limit and a circuit breaker around the Together client.
+    Calls are routed by task type to their configured model, limits and stats."""
+
+    def __init__(self, client, routes):
+        self.client = client
+        self.routes = routes
+        self.stats = {name: RouteStats() for name in routes}
+        self.stats_lock = threading.Lock()
+        self.bucket = TokenBucket(LLM_RATE_PER_SEC, LLM_BURST)
+        self.breaker = CircuitBreaker(LLM_BREAKER_THRESHOLD, LLM_BREAKER_COOLDOWN)
+        # Live calls take a slot; abandoned ones give it back but keep their worker, so
+        # the pool has room for both and a live call never waits behind a hung one
+        self.slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+        self.abandoned = 0
+        self.abandoned_lock = threading.Lock()
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY + LLM_MAX_ABANDONED,
+                                                          thread_name_prefix="llm")
+
+    def _create(self, model, prompt, max_tokens, temperature):
+        response = self.client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
+        return response.choices[0].message.content.strip(), getattr(response, "usage", None)
+
+    def _record(self, route, started, usage=None, failed=False):
+        with self.stats_lock:
+            stats = self.stats.setdefault(route, RouteStats())
+            stats.calls += 1
+            if failed:
+                stats.failures += 1
+                return
+            stats.latencies.append(time.monotonic() - started)
+            if usage is not None:
+                stats.prompt_tokens += getattr(usage, "prompt_tokens", 0) or 0
+                stats.completion_tokens += getattr(usage, "completion_tokens", 0) or 0
+
+    def complete(self, prompt, route="selector", max_tokens=None, temperature=0, timeout=None):
+        """Return the completion text or raise LLMUnavailable once the deadline or retries run out."""
+        cfg = self.routes.get(route, self.routes["selector"])
+        max_tokens = max_tokens or cfg["max_tokens"]
+        timeout = timeout or cfg["timeout"]
+        command = current_deadline()
+        if command is not None:
+            if command.cancelled:
+                raise CommandCancelled()
+            timeout = min(timeout, command.remaining())
+            if timeout <= 0:
+                raise LLMUnavailable("command budget exhausted before the AI fallback")
+        started = time.monotonic()
+        deadline = started + timeout
+        last_error = None
+        # The breaker judges logical calls: one check before, one outcome after the retries
+        if not self.breaker.allow():
+            raise LLMUnavailable("LLM circuit is open, skipping AI fallback")
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self.bucket.acquire(remaining):
+                break
+            try:
+                content, usage = self._attempt(cfg, prompt, max_tokens, temperature, deadline, command)
+                self.breaker.record_success()
+                self._record(route, started, usage)
+                return content
+            except CommandCancelled:
+                # Says nothing about the model's health
+                self.breaker.release_trial()
+                raise
+            except Exception as e:
+                last_error = e
+                if not _is_retryable(e):
+                    self.breaker.release_trial()
+                    self._record(route, started, failed=True)
+                    raise
+                print(f"[LLM] {route} attempt {attempt + 1} failed: {type(e).__name__}: {e}")
+            backoff = min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** attempt))
+            backoff = random.uniform(0, backoff)
+            if time.monotonic() + backoff >= deadline:
+                break
+            time.sleep(backoff)
+        if last_error is None:
+            # Only the rate limit or the deadline stopped it; the model was never asked
+            self.breaker.release_trial()
+        else:
+            self.breaker.record_failure()
+        self._record(route, started, failed=True)
+        raise LLMUnavailable(f"LLM did not answer in time: {last_error}")
+
+    def _attempt(self, cfg, prompt, max_tokens, temperature, deadline, command):
+        if not self.slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            raise concurrent.futures.TimeoutError("all LLM slots busy")
+        with self.abandoned_lock:
+            if self.abandoned >= LLM_MAX_ABANDONED:
+                self.slots.release()
+                raise LLMUnavailable(f"{self.abandoned} abandoned LLM calls still running")
+        future = self.pool.submit(self._create, cfg["model"], prompt, max_tokens, temperature)
+        try:
+            return self._wait(future, deadline, command)
+        except BaseException:
+            if not future.cancel():
+                # Running: cancel() cannot stop it, so it lingers until the client returns
+                with self.abandoned_lock:
+                    self.abandoned += 1
+                future.add_done_callback(self._abandoned_done)
+            raise
+        finally:
+            self.slots.release()
+
+    def _abandoned_done(self, future):
+        with self.abandoned_lock:
+            self.abandoned -= 1
+
+    def _wait(self, future, deadline, command):
+        # Short slices so a cancelled command stops waiting on the model right away
+        while True:
+            if command is not None and command.cancelled:
+                raise CommandCancelled()
+            left = deadline - time.monotonic()
+            try:
+                return future.result(timeout=max(min(left, 0.25), 0.01))
+            except concurrent.futures.TimeoutError:
+                if left <= 0.25:
+                    raise
+
+    def report(self):
+        """Per-route latency/token summary, keyed by route name."""
+        with self.stats_lock:
+            return {name: dict(model=self.routes.get(name, {}).get("model"), **stats.summary())
+                    for name, stats in self.stats.items() if stats.calls}
+
+llm = LLMGateway(client, LLM_ROUTES)
+
+class Deadline:
+    """Absolute end time for one command; every stage takes its timeout from it.
+    A nested deadline also ends when its parent does, e.g. when the user cancels."""
+
+    def __init__(self, seconds, parent=None):
+        self.budget = seconds
+        self.expires = time.monotonic() + seconds
+        self.parent = parent
+        self._cancelled = False
+
+    def remaining(self):
+        left = max(0.0, self.expires - time.monotonic())
+        if self.parent is not None:
+            left = min(left, self.parent.remaining())
+        return left
+
+    def cancel(self):
+        self._cancelled = True
+        self.expires = time.monotonic()
+
+    @property
+    def cancelled(self):
+        return self._cancelled or (self.parent is not None and self.parent.cancelled)
+
+    def expired(self):
+        return self.remaining() <= 0
+
+# A context variable rather than a thread-local so asyncio tasks each see their own deadline
+_deadline_state = contextvars.ContextVar("command_deadline", default=None)
+
+# Outermost deadline of the command each thread is running, so a spoken "cancel" can end it
+_root_deadlines = {}
+
+def current_deadline():
+    return _deadline_state.get()
+
+def cancel_commands(thread_id):
+    deadline = _root_deadlines.get(thread_id)
+    if deadline is None:
+        return False
+    deadline.cancel()
+    return True
+
+class command_deadline:
+    """Context manager that starts a budget for a command type (or of seconds).
+    Nested commands (steps of an AI plan) keep their own budget but never outlive
+    the outer one."""
+
+    def __init__(self, kind, seconds=None):
+        self.kind = kind
+        self.seconds = seconds
+        self.outer = None
+        self.token = None
+
+    def __enter__(self):
+        self.outer = current_deadline()
+        seconds = self.seconds if self.seconds is not None else COMMAND_BUDGETS.get(self.kind, COMMAND_BUDGETS["default"])
+        deadline = Deadline(seconds, parent=self.outer)
+        if self.outer is None:
+            _root_deadlines[threading.get_ident()] = deadline
+        self.token = _deadline_state.set(deadline)
+        return deadline
+
+    def __exit__(self, *exc):
+        _deadline_state.reset(self.token)
+        if self.outer is None:
+            _root_deadlines.pop(threading.get_ident(), None)
+        return False
+
+def check_cancelled():
+    """Raise CommandCancelled if the user cancelled the running command."""
+    deadline = current_deadline()
+    if deadline is not None and deadline.cancelled:
+        raise CommandCancelled()
+
+def deadline_expired():
+    """Whether the budget is used up; a cancelled command raises instead of winding down."""
+    deadline = current_deadline()
+    if deadline is not None and deadline.cancelled:
+        raise CommandCancelled()
+    return deadline is not None and deadline.expired()
+
+def stage_timeout(default_ms):
+    """A stage's usual timeout in ms, capped by what is left of the command budget.
+    Never returns 0, which Playwright would treat as "wait forever". Raises
+    CommandCancelled once the user cancelled the command."""
+    deadline = current_deadline()
+    if deadline is None:
+        return default_ms
+    if deadline.cancelled:
+        raise CommandCancelled()
+    return max(1, int(min(default_ms, deadline.remaining() * 1000)))
+
+# ---------------------------------------------------------------------------
+# Command flows. Commands are generators that yield every Playwright call they
+# make ("visible = yield loc.is_visible()") and get the result sent back. With
+# playwright.sync_api the call has already run and the sync driver just hands the
+# value back; with playwright.async_api it is an awaitable the async driver awaits.
+# Blocking work (LLM, stdin), sleeps and concurrent lookups are yielded as the ops
+# below, so BOT_ENGINE=sync and BOT_ENGINE=async run the same command code.
+# ---------------------------------------------------------------------------
+
+class offload:
+    """Blocking call (LLM request, stdin): inline for sync, in a worker thread for async."""
+
+    def __init__(self, fn, *args, **kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+
+class pause:
+    """Sleep without blocking the event loop."""
+
+    def __init__(self, seconds):
+        self.seconds = max(0.0, seconds)
+
+class first_of:
+    """First truthy result of several lookup flows, in the order given. The sync
+    driver stops at the first hit; the async one runs them all at once."""
+
+    def __init__(self, *flows):
+        self.flows = flows
+
+class spawn:
+    """Start a flow in the background; yields a deferred to collect it later.
+    Sync defers the work to that point (and skips it if it is cancelled)."""
+
+    def __init__(self, flow):
+        self.flow = flow
+
+class deferred:
+    def __init__(self, flow=None, task=None):
+        self.flow = flow
+        self.task = task
+
+    def cancel(self):
+        if self.task is not None:
+            self.task.cancel()
+        elif self.flow is not None:
+            self.flow.close()
+
+def run_sync(flow):
+    """Run a flow to completion with playwright.sync_api objects."""
+    value, error = None, None
+    while True:
+        try:
+            op = flow.throw(error) if error is not None else flow.send(value)
+        except StopIteration as stop:
+            return stop.value
+        value, error = None, None
+        try:
+            value = _sync_step(op)
+        except (Exception, CommandCancelled) as e:
+            error = e
+
+def _sync_step(op):
+    if isinstance(op, offload):
+        return op.fn(*op.args, **op.kwargs)
+    if isinstance(op, pause):
+        time.sleep(op.seconds)
+        return None
+    if isinstance(op, first_of):
+        flows = list(op.flows)
+        try:
+            while flows:
+                result = run_sync(flows.pop(0))
+                if result:
+                    return result
+        finally:
+            for flow in flows:
+                flow.close()
+        return None
+    if isinstance(op, spawn):
+        return deferred(flow=op.flow)
+    if isinstance(op, deferred):
+        return run_sync(op.flow)
+    # A sync_api call: it already ran when the flow yielded its result
+    return op
+
+async def run_async(flow):
+    """Run a flow to completion with playwright.async_api objects on the running loop."""
+    value, error = None, None
+    while True:
+        try:
+            op = flow.throw(error) if error is not None else flow.send(value)
+        except StopIteration as stop:
+            return stop.value
+        value, error = None, None
+        try:
+            value = await _async_step(op)
+        except (Exception, CommandCancelled) as e:
+            error = e
+
+async def _async_step(op):
+    if isinstance(op, offload):
+        # to_thread copies the context, so the command deadline applies in the worker too
+        return await asyncio.to_thread(op.fn, *op.args, **op.kwargs)
+    if isinstance(op, pause):
+        await asyncio.sleep(op.seconds)
+        return None
+    if isinstance(op, first_of):
+        results = await asyncio.gather(*(run_async(flow) for flow in op.flows))
+        return next((result for result in results if result), None)
+    if isinstance(op, spawn):
+        return deferred(task=asyncio.ensure_future(run_async(op.flow)))
+    if isinstance(op, deferred):
+        return await op.task
+    if inspect.isawaitable(op):
+        return await op
+    return op
+
+def shown(elem):
+    """elem if it is visible right now, otherwise None; lookup errors count as not visible."""
+    try:
+        if elem and (yield elem.is_visible()):
+            return elem
+    except Exception:
+        pass
+    return None
+
 class AnimatedOverlay:
     def __init__(self):
         self.root = tk.Tk()
@@ -139,118 +796,324 @@ class AnimatedOverlay:
     def run(self):
         self.root.mainloop()
 
-def speak(text):
-    engine = pyttsx3.init()
-    engine.say(text)
-    engine.runAndWait()
+# Phrases spoken after nearly every command; rendered once at startup
+FIXED_PHRASES = [
+    "Voice recognition is now active. Please speak your command.",
+    "Sorry, I did not understand that. Please try again.",
+    "Command not recognized or not supported.",
+    "Search submitted.", "No search bar found.", "Failed to submit search.",
+    "Login attempted.", "Login failed.", "Could not find login fields or buttons automatically.",
+    "Scrolled down.", "Scrolled up.", "No such suggestion.",
+    "Element not found or not clickable after waiting.",
+    "Could not find clickable element by heuristics.",
+    "Some clickable elements are suggested in the console.",
+    "No visible clickable elements found.",
+    "Recording started.", "Exiting.",
+]
+
+# pyttsx3 engines must not run concurrently
+_tts_lock = threading.Lock()
+
+class SpeechWindow:
+    """When the bot's own voice was playing, so the microphone can drop what it
+    captured then instead of hearing the bot as the user."""
+
+    def __init__(self, tail):
+        self.tail = tail
+        self.lock = threading.Lock()
+        self.active = 0
+        self.spans = collections.deque(maxlen=16)
+
+    def begin(self):
+        with self.lock:
+            self.active += 1
+        return time.monotonic()
+
+    def end(self, started):
+        with self.lock:
+            self.active -= 1
+            # Speakers and room echo keep going a little after playback returns
+            self.spans.append((started, time.monotonic() + self.tail))
+
+    def overlaps(self, start, end):
+        with self.lock:
+            return self.active > 0 or any(s < end and start < e for s, e in self.spans)
+
+speech_window = SpeechWindow(SPEECH_ECHO_TAIL)
+
+def _read_wav(path):
+    with wave.open(path, "rb") as wav:
+        rate, channels, width = wav.getframerate(), wav.getnchannels(), wav.getsampwidth()
+        frames = wav.readframes(wav.getnframes())
+    dtype = {1: np.uint8, 2: np.int16, 4: np.int32}[width]
+    return np.frombuffer(frames, dtype=dtype).reshape(-1, channels), rate
+
+class PhraseCache:
+    """Rendered speech kept decoded in memory: fixed phrases for the whole run,
+    templated ones in a small LRU. A miss is spoken live and rendered in the
+    background, so only repeats are played from the cache."""
+
+    def __init__(self, directory, capacity):
+        self.directory = directory
+        self.capacity = capacity
+        self.fixed = {}
+        self.recent = collections.OrderedDict()
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.renderer = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="tts-render")
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, text):
+        return os.path.join(self.directory, hashlib.sha1(text.encode("utf-8")).hexdigest()[:16] + ".wav")
+
+    def _render(self, text):
+        path = self._path(text)
+        if not os.path.exists(path):
+            os.makedirs(self.directory, exist_ok=True)
+            tmp = path[:-4] + ".tmp.wav"
+            with _tts_lock:
+                engine = pyttsx3.init()
+                engine.save_to_file(text, tmp)
+                engine.runAndWait()
+            os.replace(tmp, path)
+        return _read_wav(path)
+
+    def warm(self, phrases):
+        for text in phrases:
+            try:
+                audio = self._render(text)
+            except Exception as e:
+                print(f"[TTS] Phrase cache disabled, could not render '{text}': {e}")
+                return
+            with self.lock:
+                self.fixed[text] = audio
+        self._prune(phrases)
+
+    def _prune(self, phrases):
+        # Keep the fixed phrases plus the newest templated files from earlier runs
+        keep = {os.path.basename(self._path(t)) for t in phrases}
+        files = [f for f in os.listdir(self.directory) if f.endswith(".wav") and f not in keep]
+        files.sort(key=lambda f: os.path.getmtime(os.path.join(self.directory, f)), reverse=True)
+        for name in files[self.capacity:]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def _render_recent(self, text):
+        try:
+            audio = self._render(text)
+        except Exception as e:
+            print(f"[TTS] Could not render '{text}': {e}")
+            return
+        finally:
+            with self.lock:
+                self.pending.discard(text)
+        with self.lock:
+            self.recent[text] = audio
+            while len(self.recent) > self.capacity:
+                evicted, _ = self.recent.popitem(last=False)
+                try:
+                    os.remove(self._path(evicted))
+                except OSError:
+                    pass
+
+    def get(self, text):
+        """Decoded (samples, rate) for text, or None if it has to be spoken live."""
+        with self.lock:
+            audio = self.fixed.get(text)
+            if audio is None and text in self.recent:
+                self.recent.move_to_end(text)
+                audio = self.recent[text]
+            if audio is not None:
+                self.hits += 1
+                return audio
+            self.misses += 1
+            if len(text) > TTS_CACHE_MAX_CHARS or text in self.pending:
+                return None
+            self.pending.add(text)
+        self.renderer.submit(self._render_recent, text)
+        return None
+
+tts_cache = PhraseCache(TTS_CACHE_DIR, TTS_CACHE_SIZE) if BOT_AUDIO and TTS_CACHE and sd is not None else None
+
+# Set per thread by API sessions, which stream what the bot says instead of playing it
+_speech_sink = threading.local()
+
+def speak(text, cache=True):
+    """Say text. cache=False for phrases carrying what the user typed: they are never
+    rendered into the phrase cache, in memory or on disk."""
+    emit = getattr(_speech_sink, "emit", None)
+    if emit is not None:
+        emit(text, cache)
+        return
+    _say(text, cache)
+
+def _say(text, cache=True):
+    if not BOT_AUDIO:
+        print(f"[Say] {text}")
+        return
+    started = speech_window.begin()
+    try:
+        audio = tts_cache.get(text) if tts_cache is not None and cache else None
+        if audio is not None:
+            try:
+                sd.play(audio[0], audio[1])
+                sd.wait()
+                return
+            except Exception as e:
+                print(f"[TTS] Cached playback failed, speaking live: {e}")
+        with _tts_lock:
+            engine = pyttsx3.init()
+            engine.say(text)
+            engine.runAndWait()
+    finally:
+        speech_window.end(started)
 
 def setup_playwright():
     p = sync_playwright().start()
-    browser = p.chromium.launch(headless=False)
-    page = browser.new_page()
+    browser, page = open_browser(p)
     return p, browser, page
 
+def _cdp_endpoint():
+    return f"http://127.0.0.1:{BROWSER_CDP_PORT}"
+
+def _cdp_ready():
+    try:
+        return requests.get(f"{_cdp_endpoint()}/json/version", timeout=1).ok
+    except requests.RequestException:
+        return False
+
+def start_browser_server(p):
+    """Start the shared Chromium once; later processes find it already listening.
+    It runs in its own session so it outlives the bot process that started it."""
+    if _cdp_ready():
+        return
+    profile = os.path.join(tempfile.gettempdir(), f"bot-chromium-{BROWSER_CDP_PORT}")
+    args = [
+        p.chromium.executable_path, f"--remote-debugging-port={BROWSER_CDP_PORT}",
+        f"--user-data-dir={profile}", "--no-first-run", "--no-default-browser-check",
+    ]
+    if BROWSER_HEADLESS:
+        args.append("--headless=new")
+    print(f"[Browser] Starting shared Chromium on port {BROWSER_CDP_PORT}...")
+    subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    for _ in range(60):
+        if _cdp_ready():
+            return
+        time.sleep(0.25)
+    raise RuntimeError(f"Shared Chromium did not start on port {BROWSER_CDP_PORT}")
+
+def launch_browser(p):
+    """Launch or connect to the browser and open this process's own context and page."""
+    if BROWSER_MODE == "shared":
+        if BROWSER_WS_ENDPOINT:
+            browser = yield p.chromium.connect(BROWSER_WS_ENDPOINT)
+        else:
+            yield offload(start_browser_server, p)
+            browser = yield p.chromium.connect_over_cdp(_cdp_endpoint())
+        print(f"[Browser] Connected to shared browser {browser.version}.")
+    else:
+        browser = yield p.chromium.launch(headless=BROWSER_HEADLESS)
+    context = yield browser.new_context()
+    yield from install_prefetcher(context)
+    page = yield context.new_page()
+    watch_navigation(page)
+    if CAPTURE_RESPONSES:
+        watch_responses(page)
+    if DEBUG_TRACE:
+        yield from start_trace(page)
+    return browser, page
+
+def open_browser(p):
+    return run_sync(launch_browser(p))
+
+def reconnect_browser(p, browser, page):
+    """Reconnect (or relaunch) if the browser went away, e.g. the shared server
+    restarted, and reopen the page we were on."""
+    if browser.is_connected():
+        return browser, page
+    last_url = page.url
+    print("[Browser] Connection lost, reconnecting...")
+    for attempt in range(BROWSER_RECONNECT_ATTEMPTS):
+        try:
+            browser, page = yield from launch_browser(p)
+            if last_url.startswith("http"):
+                yield page.goto(last_url)
+            print("[Browser] Reconnected.")
+            return browser, page
+        except Exception as e:
+            print(f"[Browser] Reconnect attempt {attempt + 1} failed: {e}")
+            yield pause(min(8, 0.5 * (2 ** attempt)))
+    raise RuntimeError("Could not reconnect to the browser")
+
+def ensure_browser(p, browser, page):
+    return run_sync(reconnect_browser(p, browser, page))
+
+def click_element(elem):
+    """Scroll an element into view and click it within the command's remaining budget."""
+    check_cancelled()
+    info = yield from recorder.describe(elem)
+    try:
+        yield elem.scroll_into_view_if_needed(timeout=stage_timeout(2000))
+    except Exception:
+        pass
+    yield elem.click(timeout=stage_timeout(30000))
+    recorder.commit("click", info)
+
+def input_mode_for(url):
+    host = (urlparse(url or "").hostname or "").lower()
+    if any(host == site or host.endswith("." + site) for site in TYPE_SITES):
+        return KEY_EVENT_MODE
+    return INPUT_MODE
+
+def _element_url(elem):
+    page = getattr(elem, "page", None)
+    if page is not None:
+        return page.url
+    frame = yield elem.owner_frame()
+    return frame.url if frame else ""
+
+def type_into(elem, text):
+    """Replace a field's value with text using the configured input mode."""
+    check_cancelled()
+    mode = input_mode_for((yield from _element_url(elem))) if TYPE_SITES else INPUT_MODE
+    if mode == "fill":
+        yield elem.fill(text, timeout=stage_timeout(30000))
+    else:
+        yield elem.fill("", timeout=stage_timeout(30000))
+        yield elem.type(text, delay=TYPE_DELAY_MS if mode == "paced" else 0, timeout=stage_timeout(30000))
+    yield from recorder.record("type", elem, text)
+
+def press_key(elem, key):
+    info = yield from recorder.describe(elem)
+    yield elem.press(key, timeout=stage_timeout(30000))
+    recorder.commit("press", info, key)
+
 def find_element_smart(page, possible_selectors, field_name=None):
     # Try Playwright's robust selectors first if field_name is provided
     if field_name:
-        # Try by label
-        try:
-            el = page.get_by_label(field_name)
-            if el and el.is_visible():
-                return el
-        except Exception:
-            pass
-        # Try by test id
-        try:
-            el = page.get_by_test_id(field_name)
-            if el and el.is_visible():
-                return el
-        except Exception:
-            pass
-        # Try by role (for buttons, inputs, etc.)
-        try:
-            el = page.get_by_role("textbox", name=field_name)
-            if el and el.is_visible():
-                return el
-        except Exception:
-            pass
+        # Label, test id and role lookups are independent probes
+        el = yield first_of(
+            shown(page.get_by_label(field_name)),
+            shown(page.get_by_test_id(field_name)),
+            shown(page.get_by_role("textbox", name=field_name)),
+        )
+        if el:
+            return el
     # Fallback to provided selectors
     for selector in possible_selectors:
+        if deadline_expired():
+            break
         try:
-            el = page.query_selector(selector)
-            if el and el.is_visible():
+            el = handles.track((yield page.query_selector(selector)))
+            if el and (yield el.is_visible()):
                 return el
         except Exception:
             continue
     return None
 
-def universal_login(page, username, password):
-    username_selectors = [
-        'input[type="email"]', 'input[name*="email"]', 'input[id*="email"]',
-        'input[type="text"]', 'input[name*="user"]', 'input[id*="user"]'
-    ]
-    password_selectors = [
-        'input[type="password"]', 'input[name*="pass"]', 'input[id*="pass"]'
-    ]
-    submit_selectors = [
-        'button[type="submit"]', 'input[type="submit"]', 'button', 'input[type="button"]'
-    ]
-    # Try robust selectors first
-    user_field = find_element_smart(page, username_selectors, field_name="Username")
-    if not user_field:
-        user_field = find_element_smart(page, username_selectors, field_name="Email")
-    pass_field = find_element_smart(page, password_selectors, field_name="Password")
-    submit_btn = None
-    # Try by role for submit button
-    try:
-        submit_btn = page.get_by_role("button", name="Login")
-        if not submit_btn or not submit_btn.is_visible():
-            submit_btn = None
-    except Exception:
-        pass
-    if not submit_btn:
-        submit_btn = find_element_smart(page, submit_selectors, field_name="Login")
-    if user_field and pass_field:
-        user_field.fill("")
-        user_field.type(username)
-        pass_field.fill("")
-        pass_field.type(password)
-        if submit_btn:
-            submit_btn.click()
-            print("Login attempted.")
-            speak("Login attempted.")
-        return True
-    print("Could not find login fields/buttons automatically.")
-    speak("Could not find login fields or buttons automatically.")
-    return False
-
-def universal_search(page, search_term):
-    search_bar_selectors = [
-        'input[type="search"]', 'input[name*="search"]', 'input[id*="search"]',
-        'input[placeholder*="Search"]', 'input[aria-label*="Search"]',
-        'input[type="text"]'
-    ]
-    # Try robust selectors first
-    search_box = None
-    try:
-        search_box = page.get_by_role("searchbox")
-        if not search_box or not search_box.is_visible():
-            search_box = None
-    except Exception:
-        pass
-    if not search_box:
-        search_box = find_element_smart(page, search_bar_selectors, field_name="Search")
-    if not search_box:
-        print("No search bar found.")
-        speak("No search bar found.")
-        return False
-    search_box.fill("")
-    search_box.type(search_term)
-    search_box.press('Enter')
-    print("Search submitted with Enter key.")
-    speak("Search submitted.")
-    return True
-
 def extract_selector(ai_response):
     # Try to extract from a CSS code block
     code_block = re.search(r"```css\s*([\s\S]*?)```", ai_response, re.IGNORECASE)
@@ -283,6 +1146,145 @@ def extract_selector(ai_response):
             return line
     return ai_response.strip()
 
+def selector_list_instructions(example):
+    return (
+        f"Respond with only a JSON array of up to {AI_SELECTOR_CANDIDATES} candidate selectors, most likely first, "
+        f"e.g. {json.dumps(example)}. No explanation, no code block."
+    )
+
+def selector_candidates(ai_response):
+    """Ranked selectors from the model's JSON array, also when it is wrapped in prose
+    or an object ({"selectors": [...]}); a bare selector still works."""
+    data = None
+    text = ai_response.strip()
+    try:
+        data = json.loads(text)
+    except ValueError:
+        # The first JSON value that decodes from a bracket on; prose around it is ignored
+        decoder = json.JSONDecoder()
+        for match in re.finditer(r"[\[{]", text):
+            try:
+                data = decoder.raw_decode(text, match.start())[0]
+                break
+            except ValueError:
+                continue
+    if isinstance(data, dict):
+        lists = [v for v in data.values() if isinstance(v, list)]
+        data = lists[0] if lists else [data]
+    if isinstance(data, str):
+        data = [data]
+    candidates = []
+    for item in data if isinstance(data, list) else [extract_selector(ai_response)]:
+        if isinstance(item, dict):
+            item = item.get("selector")
+        if isinstance(item, str) and item.strip() and item.strip() not in candidates:
+            candidates.append(item.strip())
+    return candidates[:AI_SELECTOR_CANDIDATES]
+
+# Checks every candidate selector in one call: the first visible match of each is
+# scored on whether it suits the action, how much of the target its text/labels
+# contain, uniqueness and the model's rank. The winner is tagged with data-bot-sel.
+# Playwright-only syntax (role=, >>, xpath=...) is reported as unsupported.
+SELECTOR_CANDIDATES_JS = r"""
+([candidates, target, kind, token, minAffinity]) => {
+    const clean = t => (t || '').replace(/\s+/g, ' ').trim().toLowerCase();
+    const visible = el => {
+        if (!el.getClientRects().length) return false;
+        const style = getComputedStyle(el);
+        return style.visibility !== 'hidden' && style.display !== 'none';
+    };
+    const grams = t => {
+        const s = ' ' + clean(t) + ' ', out = new Set();
+        for (let i = 0; i < s.length - 1; i++) out.add(s.slice(i, i + 2));
+        return out;
+    };
+    const want = grams(target);
+    const affinity = el => {
+        const label = el.labels && el.labels.length ? el.labels[0].innerText : '';
+        const text = [el.innerText, el.value, label, el.id, el.getAttribute('aria-label'),
+            el.getAttribute('placeholder'), el.getAttribute('name'), el.getAttribute('title'),
+            el.getAttribute('alt')].filter(Boolean).join(' ').slice(0, 400);
+        if (!text || !clean(target)) return 0;
+        const have = grams(text);
+        let common = 0;
+        for (const g of want) if (have.has(g)) common++;
+        return common / want.size;
+    };
+    const FIELD = 'input:not([type=hidden]):not([type=submit]):not([type=button]):not([type=checkbox]):not([type=radio]), textarea, select, [contenteditable=""], [contenteditable="true"]';
+    // Interactive roles only: a [role=main] or [role=list] ancestor makes nothing clickable
+    const CLICKABLE = 'a, button, input, select, summary, label, video, [onclick], [tabindex]:not([tabindex="-1"]), '
+        + ['button', 'link', 'menuitem', 'menuitemcheckbox', 'menuitemradio', 'tab', 'option', 'checkbox', 'radio',
+           'switch', 'treeitem', 'gridcell'].map(r => `[role=${r}]`).join(', ');
+    const fits = el => kind === 'type' ? el.matches(FIELD) : !!el.closest(CLICKABLE) || getComputedStyle(el).cursor === 'pointer';
+    // Something clickable that shares nothing with the target is some other control
+    const related = aff => kind === 'type' || !clean(target) || aff >= minAffinity;
+    const byText = (base, wanted, exact) => {
+        const found = Array.from(document.querySelectorAll(base)).filter(el => {
+            const t = clean(el.innerText || el.value);
+            return exact ? t === wanted : t.includes(wanted);
+        }).slice(0, 200);
+        // Innermost matches only, like Playwright's text engine
+        return found.filter(el => !found.some(o => o !== el && el.contains(o)));
+    };
+    const query = sel => {
+        let m = sel.match(/^text\s*=\s*(.+)$/i);
+        if (m) {
+            const raw = m[1].trim(), quoted = /^(["']).*\1$/.test(raw);
+            return byText('body *', clean(quoted ? raw.slice(1, -1) : raw), quoted);
+        }
+        m = sel.match(/^(.*):has-text\((["'])(.*)\2\)$/);
+        if (m) return byText(m[1] || '*', clean(m[3]), false);
+        if (/>>|^[a-z_-]+=/i.test(sel)) throw new Error('unsupported');
+        return Array.from(document.querySelectorAll(sel));
+    };
+    document.querySelectorAll('[data-bot-sel]').forEach(el => el.removeAttribute('data-bot-sel'));
+    let best = null, bestEl = null;
+    const results = candidates.map((selector, rank) => {
+        let found;
+        try {
+            found = query(selector);
+        } catch (e) {
+            return {selector, rank, supported: false};
+        }
+        const nth = found.findIndex(visible);
+        if (nth < 0) return {selector, rank, supported: true, count: found.length, valid: false};
+        const el = found[nth], aff = affinity(el), ok = fits(el) && related(aff);
+        const score = aff + (found.length === 1 ? 0.2 : 0) - rank * 0.05;
+        const result = {selector, rank, supported: true, count: found.length, valid: ok, affinity: aff, score};
+        if (ok && (!best || score > best.score)) { best = result; bestEl = el; }
+        return result;
+    });
+    if (bestEl) bestEl.setAttribute('data-bot-sel', token);
+    return {best, results};
+}
+"""
+
+def _unsupported_candidates(report):
+    return [r["selector"] for r in report["results"] if not r["supported"]]
+
+def best_ai_selector(page, candidates, target, kind):
+    """The element for the best valid AI candidate as (selector, locator), or None.
+    Candidates are validated in one page.evaluate; if none is usable yet the check is
+    retried once after a short pause instead of waiting on each selector."""
+    if not candidates:
+        return None
+    token = uuid.uuid4().hex[:8]
+    for attempt in range(2):
+        report = yield page.evaluate(SELECTOR_CANDIDATES_JS, [candidates, target, kind, token, AI_SELECTOR_MIN_AFFINITY])
+        if report["best"]:
+            best = report["best"]
+            print(f"[Selector] {best['selector']} (score {best['score']:.2f}, {best['count']} match(es)).")
+            return best["selector"], page.locator(f'[data-bot-sel="{token}"]')
+        # Syntax only Playwright understands: check visibility without waiting
+        for selector in _unsupported_candidates(report):
+            loc = yield from shown(page.locator(selector).first)
+            if loc:
+                return selector, loc
+        if attempt == 0 and not deadline_expired():
+            yield page.wait_for_timeout(stage_timeout(500))
+    print(f"[Selector] None of {len(candidates)} AI candidates matched a usable element.")
+    return None
+
 def extract_ordinal(text):
     words = {
         "first": 0, "second": 1, "third": 2, "fourth": 3, "fifth": 4,
@@ -305,116 +1307,1547 @@ def fuzzy_match_title(user_input, item_info):
                 return i, elem
     return None, None
 
-def save_debug_info(page, context):
-    """Save a screenshot and HTML dump for debugging when selectors fail."""
+CLICKABLE_SELECTORS = [
+    'a', 'button', '[role=button]', '[role=link]', '[tabindex="0"]', '[onclick]', '[data-testid]', '[aria-label]'
+]
+
+# Installed as an init script on every page. Once the page has loaded it builds, in
+# an idle callback, the clickable/input index and the prompt outline for the top
+# frame and tags each element with data-bot-id so Python can address it with a cheap
+# locator. DOM changes only mark the index dirty; get_page_index rebuilds it on demand.
+PAGE_INDEX_JS = r"""
+(() => {
+    // Lookups only read the top frame's index; iframes would pay for nothing
+    if (window !== window.top || window.__botIndexInstalled) return;
+    window.__botIndexInstalled = true;
+    let version = 0, nextId = 0, timer = null, dirty = true;
+    const clean = t => (t || '').replace(/\s+/g, ' ').trim();
+    const visible = el => el.getClientRects().length > 0 && getComputedStyle(el).visibility !== 'hidden';
+    const tag = (el, prefix) => {
+        if (!el.hasAttribute('data-bot-id')) el.setAttribute('data-bot-id', prefix + (nextId++));
+        return el.getAttribute('data-bot-id');
+    };
+    const attrs = el => ['id', 'name', 'type', 'class', 'href', 'placeholder', 'aria-label', 'role']
+        .filter(a => el.getAttribute(a)).map(a => `${a}="${el.getAttribute(a).slice(0, 60)}"`).join(' ');
+    const build = () => {
+        const clickables = [], inputs = [], outline = [], seen = new Set();
+        for (const el of document.querySelectorAll('h1, h2, h3, a, button, [role=button], [role=link], [tabindex="0"], [onclick], [data-testid], [aria-label], input, textarea, select')) {
+            if (!visible(el)) continue;
+            const tagName = el.tagName.toLowerCase();
+            if (['input', 'textarea', 'select'].includes(tagName)) {
+                if (['hidden', 'submit', 'button'].includes(el.type)) continue;
+                const label = el.getAttribute('aria-label') || el.getAttribute('placeholder') || el.getAttribute('name') || el.id
+                    || (el.labels && el.labels[0] ? clean(el.labels[0].innerText) : '') || `input #${inputs.length}`;
+                inputs.push({id: tag(el, 'i'), label, type: el.type || tagName});
+                outline.push(`<${tagName} ${attrs(el)}>`);
+                continue;
+            }
+            const text = clean(el.innerText) || el.getAttribute('aria-label') || el.getAttribute('title') || el.getAttribute('name') || el.id;
+            if (/^h[1-3]$/.test(tagName)) {
+                if (text) outline.push(`<${tagName}>${text.slice(0, 80)}</${tagName}>`);
+                continue;
+            }
+            if (!text || seen.has(text)) continue;
+            seen.add(text);
+            clickables.push({id: tag(el, 'c'), text: text.slice(0, 200), tag: tagName});
+            outline.push(`<${tagName} ${attrs(el)}>${text.slice(0, 80)}</${tagName}>`);
+        }
+        version += 1;
+        dirty = false;
+        window.__botIndex = {version, url: location.href, builtAt: Date.now(), clickables, inputs,
+            outline: `<title>${document.title}</title>\n` + outline.join('\n')};
+    };
+    const schedule = (delay) => {
+        clearTimeout(timer);
+        timer = setTimeout(() => (window.requestIdleCallback || setTimeout)(build, {timeout: 1000}), delay);
+    };
+    window.__botBuildIndex = () => { clearTimeout(timer); build(); return window.__botIndex; };
+    window.__botIndexStale = () => dirty;
+    const start = () => {
+        new MutationObserver(() => { dirty = true; }).observe(document.documentElement, {childList: true, subtree: true});
+        schedule(200);
+    };
+    if (document.readyState !== 'complete') window.addEventListener('load', start, {once: true});
+    else start();
+})()
+"""
+
+def install_prefetcher(context):
+    """Register the page index builder on every page the context opens."""
     try:
-        fname = f"debug_{context}_{uuid.uuid4().hex[:8]}"
-        page.screenshot(path=f"{fname}.png")
-        with open(f"{fname}.html", "w", encoding="utf-8") as f:
-            f.write(page.content())
-        print(f"[DEBUG] Saved screenshot and HTML as {fname}.png/.html")
+        yield context.add_init_script(PAGE_INDEX_JS)
     except Exception as e:
-        print(f"[DEBUG] Failed to save debug info: {e}")
+        print(f"[Prefetch] Could not install page index script: {e}")
 
-def handle_command(page, command):
-    tokens = command.lower().split()
-    if not tokens:
-        return
+def get_page_index(page):
+    """Return the prefetched index for the current page, building it now if the
+    background pass has not finished yet. Cached on the page by (url, version, builtAt):
+    version restarts with every document, so a reload of the same URL needs builtAt."""
+    try:
+        # A DOM change the idle rebuild has not caught up with yet is rebuilt in place
+        state = yield page.evaluate(
+            "() => { if (window.__botIndexStale && window.__botIndexStale()) window.__botBuildIndex();"
+            " const i = window.__botIndex; return i ? [i.url, i.version, i.builtAt] : null; }"
+        )
+        cached = getattr(page, "_bot_index", None)
+        if state and cached and [cached["url"], cached["version"], cached.get("builtAt")] == state:
+            return cached
+        if state:
+            index = yield page.evaluate("() => window.__botIndex")
+        else:
+            # Page loaded before the init script (or it has not run yet): build inline
+            index = yield page.evaluate("() => window.__botBuildIndex ? window.__botBuildIndex() : null")
+            if index is None:
+                yield page.evaluate(PAGE_INDEX_JS)
+                index = yield page.evaluate("() => window.__botBuildIndex()")
+    except Exception as e:
+        print(f"[Prefetch] Page index unavailable: {e}")
+        return None
+    page._bot_index = index
+    return index
 
-    if tokens[0] == "open" and len(tokens) > 1:
-        url = tokens[1]
-        if not url.startswith("http"):
-            if '.' not in url:
-                url += ".com"
-                url = "https://" + url
-            else:
-                url = "https://" + url
-        try:
-            page.goto(url)
-            print(f"Opened {url}")
-            speak(f"Opened {url}")
-        except Exception as e:
-            print(f"[ERROR] Failed to open {url}: {e}")
-            speak(f"Failed to open {url}.")
-            save_debug_info(page, "open_url")
-        return
+def prompt_html(page, limit=3000):
+    """Compact outline of the page's interactive elements for LLM prompts."""
+    index = yield from get_page_index(page)
+    if index and index.get("outline"):
+        return index["outline"][:limit]
+    return (yield page.content())[:limit]
 
-    if tokens[0] == "search":
-        search_term = " ".join(tokens[1:])
-        try:
-            search_box = page.get_by_role("searchbox")
-            if not search_box or not search_box.is_visible():
-                search_box = None
-        except Exception:
-            search_box = None
-        if not search_box:
-            search_bar_selectors = [
-                'input[type="search"]', 'input[name*="search"]', 'input[id*="search"]',
-                'input[placeholder*="Search"]', 'input[aria-label*="Search"]',
-                'input[type="text"]'
-            ]
-            search_box = find_element_smart(page, search_bar_selectors, field_name="Search")
-        if search_box:
-            try:
-                search_box.fill("")
-                search_box.type(search_term)
-                search_box.press('Enter')
-                print(f"Search submitted.")
-                speak("Search submitted.")
-            except Exception as e:
-                print(f"[ERROR] Failed to type/search: {e}")
-                speak("Failed to submit search.")
-                save_debug_info(page, "search")
+def harvest_clickables(page):
+    """Collect visible clickable elements as (text, element) pairs, unique by text."""
+    index = yield from get_page_index(page)
+    if index is not None:
+        return [(item["text"], page.locator(f'[data-bot-id="{item["id"]}"]')) for item in index["clickables"]]
+    clickable = []
+    seen = set()
+    for sel in CLICKABLE_SELECTORS:
+        for elem in handles.track_all((yield page.query_selector_all(sel))):
+            if (yield elem.is_visible()):
+                text = None
+                try:
+                    text = (yield elem.inner_text()).strip()
+                except Exception:
+                    pass
+                if not text:
+                    try:
+                        text = ((yield elem.get_attribute('aria-label')) or (yield elem.get_attribute('title'))
+                                or (yield elem.get_attribute('name')) or (yield elem.get_attribute('id')))
+                    except Exception:
+                        text = None
+                if text and text not in seen:
+                    clickable.append((text, elem))
+                    seen.add(text)
+    return clickable
+
+def _text_features(text):
+    """Hashed word and character 2-4 gram ids for one text."""
+    text = re.sub(r"\s+", " ", text.lower()).strip()
+    feats = ["w:" + w for w in re.findall(r"\w+", text)]
+    padded = f" {text} "
+    for n in (2, 3, 4):
+        feats.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+    return [zlib.crc32(f.encode("utf-8")) % CLICK_RANK_DIM for f in feats]
+
+def embed_texts(texts):
+    """TF-IDF weighted, L2-normalised n-gram vectors for all texts at once, kept
+    sparse: one (row, column, weight) entry per distinct feature of a text, so memory
+    grows with the n-grams present rather than texts x vocabulary. Returns (cells,
+    vocab, idf): vocab is the sorted feature ids of the columns, idf their weights."""
+    feats = [np.asarray(_text_features(text), dtype=np.int64) for text in texts]
+    rows = np.repeat(np.arange(len(texts)), [len(f) for f in feats])
+    vocab, cols = np.unique(np.concatenate(feats), return_inverse=True)
+    # Term counts per distinct (row, column) cell
+    cells, counts = np.unique(rows * len(vocab) + cols, return_counts=True)
+    rows, cols = cells // len(vocab), cells % len(vocab)
+    df = np.bincount(cols, minlength=len(vocab))
+    idf = (np.log((1.0 + len(texts)) / (1.0 + df)) + 1.0).astype(np.float32)
+    weights = np.log1p(counts.astype(np.float32)) * idf[cols]
+    norms = np.sqrt(np.bincount(rows, weights=weights * weights, minlength=len(texts)))
+    weights /= np.maximum(norms[rows], 1e-9)
+    return (rows, cols, weights), vocab, idf
+
+# Local click-target ranking (hashed character n-gram TF-IDF)
+def score_click_targets(target, texts):
+    """Cosine score of every candidate text against the spoken target, in one
+    sparse product; None without a target or candidates."""
+    if not target or not texts:
+        return None
+    (rows, cols, cell_weights), vocab, idf = embed_texts(texts)
+    ids, counts = np.unique(np.asarray(_text_features(target), dtype=np.int64), return_counts=True)
+    # Features no candidate has add nothing to a dot product, but still count in the
+    # query's norm, with the idf of a feature seen in no text
+    weights = np.log1p(counts.astype(np.float32))
+    pos = np.minimum(np.searchsorted(vocab, ids), len(vocab) - 1)
+    known = vocab[pos] == ids
+    unseen_idf = np.log(1.0 + len(texts)) + 1.0
+    weights *= np.where(known, idf[pos], unseen_idf)
+    query = np.zeros(len(vocab), dtype=np.float32)
+    query[pos[known]] = weights[known]
+    # Sparse matrix-vector product: every cell adds its share to its row's score
+    scores = np.bincount(rows, weights=cell_weights * query[cols], minlength=len(texts))
+    return scores / max(float(np.linalg.norm(weights)), 1e-9)
+
+def confident_target(scores):
+    """(index, score) when the best score is high and clear of the runner-up, else None."""
+    if scores is None:
+        return None
+    best = int(np.argmax(scores))
+    best_score = float(scores[best])
+    runner_up = float(np.partition(scores, -2)[-2]) if len(scores) > 1 else 0.0
+    if best_score >= CLICK_RANK_MIN_SCORE and best_score - runner_up >= CLICK_RANK_MARGIN:
+        return best, best_score
+    return None
+
+def close_targets(scores, n=3):
+    """Indices of up to n candidates that all score well but too close to each other
+    to pick one, best first; fewer than two means the ranking is not ambiguous."""
+    if scores is None:
+        return []
+    top = np.argsort(-scores)[:n]
+    best = float(scores[top[0]])
+    return [int(i) for i in top if scores[i] >= CLICK_RANK_MIN_SCORE and best - scores[i] < CLICK_RANK_MARGIN]
+
+def rank_click_targets(target, texts):
+    """Returns (index, score) when the best match is confident, otherwise None."""
+    return confident_target(score_click_targets(target, texts))
+
+# "<ts>_<context>_<id>.jpg|.html.gz": only files the writer named are counted and pruned,
+# anything else kept in DEBUG_DIR (traces, notes) stays
+DEBUG_ARTIFACT_NAME = re.compile(r"^\d{8}-\d{6}_.+_[0-9a-f]{6}\.(?:jpg|html\.gz)$")
+
+class ArtifactWriter:
+    """Writes debug artifacts on a background thread and keeps DEBUG_DIR as a ring
+    buffer: the oldest files go once the count or size cap is passed. Captures that
+    arrive while the queue is full are dropped rather than slowing the command."""
+
+    def __init__(self, directory, max_files, max_bytes):
+        self.directory = directory
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.pending = queue.Queue(maxsize=8)
+        self.files = None
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._run, name="artifact-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, context, jpeg, html):
+        try:
+            self.pending.put_nowait((context, jpeg, html))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _scan(self):
+        os.makedirs(self.directory, exist_ok=True)
+        paths = [os.path.join(self.directory, f) for f in os.listdir(self.directory) if DEBUG_ARTIFACT_NAME.match(f)]
+        paths = [p for p in paths if os.path.isfile(p)]
+        paths.sort(key=os.path.getmtime)
+        return collections.deque((p, os.path.getsize(p)) for p in paths)
+
+    def _run(self):
+        while True:
+            context, jpeg, html = self.pending.get()
+            try:
+                if self.files is None:
+                    self.files = self._scan()
+                base = os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}_{context}_{uuid.uuid4().hex[:6]}")
+                written = []
+                if jpeg:
+                    with open(base + ".jpg", "wb") as f:
+                        f.write(jpeg)
+                    written.append(base + ".jpg")
+                if html:
+                    with gzip.open(base + ".html.gz", "wb", compresslevel=6) as f:
+                        f.write(html.encode("utf-8"))
+                    written.append(base + ".html.gz")
+                for path in written:
+                    self.files.append((path, os.path.getsize(path)))
+                self._prune()
+                print(f"[DEBUG] Saved {', '.join(os.path.basename(p) for p in written)}")
+            except Exception as e:
+                print(f"[DEBUG] Failed to write debug artifacts: {e}")
+
+    def _prune(self):
+        total = sum(size for _, size in self.files)
+        while self.files and (len(self.files) > self.max_files or total > self.max_bytes):
+            path, size = self.files.popleft()
+            total -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+artifacts = ArtifactWriter(DEBUG_DIR, DEBUG_MAX_FILES, int(DEBUG_MAX_MB * 1048576)) if DEBUG_CAPTURE else None
+
+# Incremental harvest of clickable items. The first call scans the document; after that a
+# MutationObserver queues only nodes attached (or re-labelled, or whose text changed)
+# since the last call, so each step scans just the new rows. The queue is capped: past
+# HARVEST_PENDING_CAP roots it collapses to one full rescan. Items are keyed by (href,
+# text), which survives the node recycling of virtualized lists; their elements are
+# tagged with data-bot-h, and a recycled node loses a tag that no longer fits its row.
+SCROLL_HARVEST_JS = r"""
+(opts) => {
+    const SEL = 'a, button, [role=button], [role=link], [tabindex="0"], [onclick], [data-testid], [aria-label]';
+    const clean = t => (t || '').replace(/\s+/g, ' ').trim();
+    const visible = el => el.getClientRects().length > 0 && getComputedStyle(el).visibility !== 'hidden';
+    let h = window.__botHarvest;
+    if (!h || h.url !== location.href || !document.body.contains(h.body)) {
+        if (h && h.observer) h.observer.disconnect();
+        h = window.__botHarvest = {url: location.href, body: document.body, items: [], keys: new Set(), keyOf: {}, pending: [document.body], next: 0};
+        h.observer = new MutationObserver(mutations => {
+            if (h.pending.length > opts.cap) return;
+            for (const m of mutations) {
+                if (m.type === 'attributes') h.pending.push(m.target);
+                else if (m.type === 'characterData') h.pending.push(m.target.parentElement);
+                for (const n of m.addedNodes) h.pending.push(n.nodeType === 1 ? n : n.parentElement);
+            }
+            // A page left open keeps mutating; past the cap one rescan replaces the queue
+            if (h.pending.length > opts.cap) h.pending = [document.body];
+        });
+        h.observer.observe(document.body, {childList: true, subtree: true, characterData: true, attributes: true, attributeFilter: ['href']});
+    }
+    const added = [];
+    const take = el => {
+        if (!el.isConnected || !visible(el)) return;
+        const text = clean(el.innerText) || el.getAttribute('aria-label') || el.getAttribute('title') || '';
+        if (!text) return;
+        const href = el.getAttribute('href') ? el.href : '';
+        const key = href + '|' + text.slice(0, 200);
+        // Recycled for another row: the old tag would make a click hit the wrong item
+        const tagged = el.getAttribute('data-bot-h');
+        if (tagged && h.keyOf[tagged] !== key) el.removeAttribute('data-bot-h');
+        if (h.keys.has(key)) return;
+        h.keys.add(key);
+        // A recycled node gets a fresh id; the item it showed before keeps its href/text
+        const id = 'h' + (h.next++);
+        el.setAttribute('data-bot-h', id);
+        h.keyOf[id] = key;
+        const item = {id, text: text.slice(0, 200), href};
+        h.items.push(item);
+        added.push(item);
+    };
+    let roots = h.pending.splice(0).filter(r => r && r.isConnected);
+    if (roots.length < 500) roots = roots.filter(r => !roots.some(o => o !== r && o.contains(r)));
+    for (const root of roots) {
+        const owner = root.closest(SEL);
+        if (owner) take(owner);
+        for (const el of root.querySelectorAll(SEL)) take(el);
+    }
+    let atEnd = false;
+    if (opts.scroll) {
+        const doc = document.scrollingElement || document.documentElement;
+        let target = doc;
+        if (doc.scrollHeight <= doc.clientHeight + 10) {
+            // Page itself does not scroll: use the largest scrollable container (feeds, grids)
+            let best = 0;
+            for (const el of document.querySelectorAll('*')) {
+                if (el.scrollHeight > el.clientHeight + 10 && /(auto|scroll)/.test(getComputedStyle(el).overflowY)
+                    && el.clientHeight * el.clientWidth > best) {
+                    best = el.clientHeight * el.clientWidth;
+                    target = el;
+                }
+            }
+        }
+        const before = target.scrollTop;
+        target.scrollTop = before + Math.max(200, (target === doc ? window.innerHeight : target.clientHeight) * 0.9);
+        atEnd = target.scrollTop === before;
+    }
+    return {added: opts.all ? h.items : added, total: h.items.length, atEnd};
+}
+"""
+
+# The (href, text) key SCROLL_HARVEST_JS gives an element
+HARVEST_KEY_JS = r"""
+el => {
+    const text = (el.innerText || '').replace(/\s+/g, ' ').trim() || el.getAttribute('aria-label') || el.getAttribute('title') || '';
+    return (el.getAttribute('href') ? el.href : '') + '|' + text.slice(0, 200);
+}
+"""
+
+def _strong_match(target, texts):
+    target = target.lower()
+    return any(target in t.lower() or difflib.SequenceMatcher(None, target, t.lower()).ratio() >= 0.8 for t in texts)
+
+def scroll_harvest(page, until_count=None, until_match=None):
+    """Clickable items of the page, scrolling in steps until until_count items are
+    known, one clearly matches until_match, the budget runs out or the content ends.
+    A title with only a loose match gets SCROLL_HARVEST_LOOSE_STEPS more steps to
+    turn up a clear one. Each step merges only elements attached since the previous one."""
+    items = (yield page.evaluate(SCROLL_HARVEST_JS, {"all": True, "scroll": False, "cap": HARVEST_PENDING_CAP}))["added"]
+    quiet = 0
+    loose_since = None
+    for step in range(SCROLL_HARVEST_MAX_STEPS):
+        if until_count is not None and len(items) >= until_count:
+            break
+        if until_match:
+            texts = [i["text"] for i in items]
+            if _strong_match(until_match, texts):
+                break
+            # The same 0.4 cutoff fuzzy_match_title picks with
+            if loose_since is None and get_close_matches(until_match, texts, n=1, cutoff=0.4):
+                loose_since = step
+            if loose_since is not None and step - loose_since >= SCROLL_HARVEST_LOOSE_STEPS:
+                break
+        if deadline_expired() or len(items) >= SCROLL_HARVEST_MAX_ITEMS:
+            break
+        result = yield page.evaluate(SCROLL_HARVEST_JS, {"scroll": True, "cap": HARVEST_PENDING_CAP})
+        items.extend(result["added"])
+        # Two scrolls in a row that neither move nor add anything: end of content
+        quiet = quiet + 1 if result["atEnd"] and not result["added"] else 0
+        if quiet >= 2:
+            break
+        yield page.wait_for_timeout(max(1, min(SCROLL_HARVEST_PAUSE_MS, stage_timeout(SCROLL_HARVEST_PAUSE_MS))))
+    else:
+        step = SCROLL_HARVEST_MAX_STEPS
+    items.extend((yield page.evaluate(SCROLL_HARVEST_JS, {"scroll": False, "cap": HARVEST_PENDING_CAP}))["added"])
+    if step:
+        print(f"[Harvest] {len(items)} items after {step} scroll steps.")
+    return items
+
+def click_harvested(page, item):
+    """Click a harvested item; if a virtualized list recycled its node, find it by
+    link or text instead."""
+    loc = page.locator(f'[data-bot-h="{item["id"]}"]')
+    # The tag is only trusted while the node still shows the item it was given for
+    if (yield loc.count()) == 1 and (yield loc.evaluate(HARVEST_KEY_JS)) == f'{item["href"]}|{item["text"]}':
+        yield from click_element(loc)
+        return
+    if item["href"]:
+        link = page.locator(f'a[href="{_css_string(item["href"])}"]').first
+        if (yield link.count()):
+            yield from click_element(link)
+            return
+        yield page.goto(item["href"], timeout=stage_timeout(30000))
+        recorder.record_goto(page.url)
+        return
+    yield from click_element(page.get_by_text(item["text"], exact=True).first)
+
+def save_debug_info(page, context):
+    """Capture a viewport JPEG and the HTML when selectors fail; compression and disk
+    writes happen on the artifact writer thread."""
+    if artifacts is None:
+        return
+    try:
+        jpeg = yield page.screenshot(type="jpeg", quality=DEBUG_JPEG_QUALITY, timeout=stage_timeout(3000))
+    except Exception as e:
+        print(f"[DEBUG] Screenshot failed: {e}")
+        jpeg = None
+    try:
+        html = yield page.content()
+    except Exception as e:
+        print(f"[DEBUG] Failed to read page HTML: {e}")
+        html = None
+    if not artifacts.submit(context, jpeg, html):
+        print("[DEBUG] Artifact writer busy, capture dropped.")
+
+def start_trace(page):
+    context = page.context
+    if getattr(context, "_bot_tracing", False):
+        return False
+    yield context.tracing.start(screenshots=True, snapshots=True, sources=False)
+    context._bot_tracing = True
+    return True
+
+def stop_trace(page):
+    """Stop this session's trace and save it to DEBUG_DIR; returns the path or None."""
+    context = page.context
+    if not getattr(context, "_bot_tracing", False):
+        return None
+    os.makedirs(DEBUG_DIR, exist_ok=True)
+    path = os.path.join(DEBUG_DIR, f"trace_{time.strftime('%Y%m%d-%H%M%S')}_{uuid.uuid4().hex[:6]}.zip")
+    yield context.tracing.stop(path=path)
+    context._bot_tracing = False
+    return path
+
+# In-page pass that collects every visible <table> and every group of repeated
+# sibling elements (cards, result rows, list items) as plain row dicts.
+STRUCTURE_SCAN_JS = r"""
+(minRepeat) => {
+    const clean = t => (t || '').replace(/\s+/g, ' ').trim();
+    const visible = el => el.getClientRects().length > 0 && getComputedStyle(el).visibility !== 'hidden';
+    const priceRe = /(?:[$€£¥₹]\s?\d[\d.,]*|\d[\d.,]*\s?(?:USD|EUR|GBP|INR|Rs\.?))/i;
+    const blocks = [];
+
+    for (const table of document.querySelectorAll('table')) {
+        if (!visible(table) || table.rows.length < 2) continue;
+        const rows = Array.from(table.rows);
+        let headerRow = null;
+        if (table.tHead && table.tHead.rows.length) headerRow = table.tHead.rows[0];
+        else if (Array.from(rows[0].cells).every(c => c.tagName === 'TH')) headerRow = rows[0];
+        const headers = headerRow ? Array.from(headerRow.cells).map((c, i) => clean(c.innerText) || `col${i + 1}`) : [];
+        const data = [];
+        for (const r of rows) {
+            if (r === headerRow || r.parentElement === table.tHead) continue;
+            const cells = Array.from(r.cells).map(c => clean(c.innerText));
+            if (!cells.some(Boolean)) continue;
+            const row = {};
+            cells.forEach((v, i) => { row[headers[i] || `col${i + 1}`] = v; });
+            const link = r.querySelector('a[href]');
+            if (link) row.url = link.href;
+            data.push(row);
+        }
+        if (data.length) {
+            const label = table.caption ? clean(table.caption.innerText) : (table.getAttribute('aria-label') || 'table');
+            blocks.push({kind: 'table', label, rows: data});
+        }
+    }
+
+    const signature = el => el.tagName + '.' + Array.from(el.classList).sort().join('.');
+    for (const parent of document.querySelectorAll('body *')) {
+        if (parent.children.length < minRepeat || parent.closest('table, nav, header, footer, select')) continue;
+        const groups = new Map();
+        for (const kid of parent.children) {
+            const sig = signature(kid);
+            if (!groups.has(sig)) groups.set(sig, []);
+            groups.get(sig).push(kid);
+        }
+        for (const [sig, items] of groups) {
+            if (items.length < minRepeat) continue;
+            const rows = [];
+            for (const item of items) {
+                if (!visible(item)) continue;
+                const text = clean(item.innerText);
+                if (text.length < 3) continue;
+                const heading = item.querySelector('h1, h2, h3, h4, h5, h6, [class*="title" i]');
+                const link = item.tagName === 'A' ? item : item.querySelector('a[href]');
+                const img = item.querySelector('img[src]');
+                const price = text.match(priceRe);
+                const row = {title: clean(heading ? heading.innerText : (link ? link.innerText : text)).slice(0, 200)};
+                if (price) row.price = price[0];
+                if (link && link.href) row.url = link.href;
+                if (img) row.image = img.src;
+                row.text = text.slice(0, 500);
+                rows.push(row);
+            }
+            if (rows.length >= minRepeat) blocks.push({kind: 'list', label: sig.toLowerCase(), rows});
+        }
+    }
+    return blocks;
+}
+"""
+
+# Finds the "next page" control for paginated result lists, if any.
+NEXT_PAGE_JS = r"""
+() => {
+    const usable = el => el.getClientRects().length > 0 && !el.disabled && el.getAttribute('aria-disabled') !== 'true';
+    const labelOf = el => ((el.getAttribute('aria-label') || el.innerText || '') + '').trim().toLowerCase();
+    // Exact pagination labels only: "Next.js guide" or "Next slide" are not pages
+    const words = ['next', 'next page', 'next ›', 'next »', '›', '»'];
+    const pager = 'nav, [role="navigation"], [class*="pagination" i], [class*="pager" i]';
+    // An SPA keeps the control from the previous page; only one may carry the mark
+    document.querySelectorAll('[data-bot-next]').forEach(el => el.removeAttribute('data-bot-next'));
+    const mark = el => {
+        el.setAttribute('data-bot-next', '1');
+        return {selector: '[data-bot-next="1"]', href: el.tagName === 'A' ? el.href : null};
+    };
+    // The page's own rel=next wins over anything that merely looks like a next button
+    const relNext = Array.from(document.querySelectorAll('a[rel~="next" i]')).find(usable);
+    if (relNext) return mark(relNext);
+    const link = document.querySelector('link[rel~="next" i]');
+    if (link && link.href) return {href: link.href};
+    for (const el of document.querySelectorAll('a, button, [role="button"], [role="link"]')) {
+        if (!usable(el)) continue;
+        const label = labelOf(el);
+        const aria = (el.getAttribute('aria-label') || '').toLowerCase();
+        if (words.includes(label) || (/\bnext\b/.test(aria) && el.closest(pager))) return mark(el);
+    }
+    return null;
+}
+"""
+
+def _next_rows(page, block):
+    """Structure scan after following "next". An SPA swaps the rows in place some
+    time after the click, so scan until the rows differ from the page just written."""
+    previous = block["rows"]
+    waited = 0
+    while True:
+        blocks = yield page.evaluate(STRUCTURE_SCAN_JS, EXTRACT_MIN_REPEAT)
+        same_kind = [b for b in blocks if b["kind"] == block["kind"] and b["label"] == block["label"]]
+        if not same_kind or any(b["rows"] != previous for b in same_kind) or waited >= EXTRACT_NEXT_WAIT_MS:
+            return blocks
+        if deadline_expired():
+            return blocks
+        yield page.wait_for_timeout(max(1, min(250, stage_timeout(250))))
+        waited += 250
+
+class RowWriter:
+    """Streams extracted rows to a JSONL or CSV file as they arrive. The CSV header
+    is fieldnames when given (the keys of the whole first block), else the first row's."""
+
+    def __init__(self, path, fmt="jsonl", fieldnames=None):
+        self.path = path
+        self.fmt = fmt
+        self.fieldnames = fieldnames
+        self.count = 0
+        self._file = open(path, "w", encoding="utf-8", newline="")
+        self._csv = None
+
+    def write(self, row):
+        if self.fmt == "csv":
+            if self._csv is None:
+                # Keys that only appear on later pages are trimmed
+                self._csv = csv.DictWriter(self._file, fieldnames=self.fieldnames or list(row.keys()),
+                                           extrasaction="ignore")
+                self._csv.writeheader()
+            self._csv.writerow(row)
+        else:
+            self._file.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self.count += 1
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+def pick_structure(blocks, target):
+    """Choose the table/list block that best matches what the user asked for."""
+    if not blocks:
+        return None
+    words = [w.rstrip("s") for w in re.findall(r"\w+", (target or "").lower()) if len(w) > 2]
+    wants_price = any(w in ("price", "cost") for w in words)
+
+    def score(block):
+        rows = block["rows"]
+        keys = set()
+        for row in rows:
+            keys.update(row.keys())
+        s = len(rows) * (1 + len(keys))
+        if block["kind"] == "table":
+            s *= 1.5
+        if wants_price:
+            s *= 1 + sum(1 for row in rows if "price" in row or any("price" in k.lower() for k in row))
+        blob = json.dumps(rows[:20]).lower()
+        s *= 1 + sum(1 for w in words if w in blob)
+        return s
+
+    return max(blocks, key=score)
+
+def extract_path(target, fmt):
+    os.makedirs(EXTRACT_DIR, exist_ok=True)
+    slug = re.sub(r"\W+", "_", (target or "data").lower()).strip("_") or "data"
+    return os.path.join(EXTRACT_DIR, f"{slug}_{uuid.uuid4().hex[:8]}.{fmt}")
+
+def extract_structured(page, target, fmt=None, max_pages=None, out_path=None):
+    """Deterministically extract a table or repeated card list, following pagination.
+    Returns (row_count, path) or (0, None) when the page has no usable structure."""
+    fmt = (fmt or EXTRACT_FORMAT).lower()
+    if fmt not in ("jsonl", "csv"):
+        fmt = "jsonl"
+    max_pages = max_pages or EXTRACT_MAX_PAGES
+    try:
+        blocks = yield page.evaluate(STRUCTURE_SCAN_JS, EXTRACT_MIN_REPEAT)
+    except Exception as e:
+        print(f"[Extract] Structure scan failed: {e}")
+        return 0, None
+    block = pick_structure(blocks, target)
+    if not block:
+        return 0, None
+    if not out_path:
+        out_path = extract_path(target, fmt)
+    # Rows of one block differ in their optional cells (badges, ratings): header is the union
+    writer = RowWriter(out_path, fmt, fieldnames=list(dict.fromkeys(k for row in block["rows"] for k in row)))
+    seen = set()
+    try:
+        pages = 0
+        while block:
+            pages += 1
+            new_rows = 0
+            for row in block["rows"]:
+                key = json.dumps(row, sort_keys=True)
+                if key in seen:
+                    continue
+                seen.add(key)
+                writer.write(row)
+                new_rows += 1
+            print(f"[Extract] Page {pages}: {new_rows} new {block['kind']} rows ({block['label']}).")
+            if pages >= max_pages or not new_rows or deadline_expired():
+                break
+            # Follow pagination, then re-scan the next page for the same kind of structure
+            try:
+                nxt = yield page.evaluate(NEXT_PAGE_JS)
+            except Exception:
+                nxt = None
+            if not nxt:
+                break
+            try:
+                if nxt.get("selector"):
+                    yield page.click(nxt["selector"], timeout=stage_timeout(3000))
+                    yield page.evaluate("() => document.querySelectorAll('[data-bot-next]').forEach(el => el.removeAttribute('data-bot-next'))")
+                else:
+                    yield page.goto(nxt["href"], timeout=stage_timeout(30000))
+                yield page.wait_for_load_state("domcontentloaded", timeout=stage_timeout(10000))
+                blocks = yield from _next_rows(page, block)
+            except Exception as e:
+                print(f"[Extract] Pagination stopped: {e}")
+                break
+            same_kind = [b for b in blocks if b["kind"] == block["kind"] and b["label"] == block["label"]]
+            block = pick_structure(same_kind or blocks, target)
+    finally:
+        writer.close()
+    return writer.count, out_path
+
+# Describes a resolved element with a selector that survives a reload: id, then
+# stable attributes, then an nth-of-type path from the nearest id or <body>.
+DESCRIBE_ELEMENT_JS = r"""
+el => {
+    const esc = v => CSS.escape(v);
+    const unique = sel => { try { return document.querySelectorAll(sel).length === 1; } catch (e) { return false; } };
+    const tag = el.tagName.toLowerCase();
+    const info = {
+        text: (el.innerText || el.value || el.getAttribute('aria-label') || '').replace(/\s+/g, ' ').trim().slice(0, 200),
+        url: location.href,
+        label: ((el.labels && el.labels.length ? el.labels[0].innerText : '') || el.getAttribute('aria-label')
+            || el.getAttribute('placeholder') || el.getAttribute('name') || '').replace(/\s+/g, ' ').trim().slice(0, 100),
+        secret: tag === 'input' && el.type === 'password',
+    };
+    if (el.id && unique('#' + esc(el.id))) return {...info, selector: '#' + esc(el.id)};
+    for (const attr of ['data-testid', 'name', 'aria-label', 'placeholder', 'href']) {
+        const value = el.getAttribute(attr);
+        if (!value) continue;
+        const sel = `${tag}[${attr}="${value.replace(/\\/g, '\\\\').replace(/"/g, '\\"')}"]`;
+        if (unique(sel)) return {...info, selector: sel};
+    }
+    const parts = [];
+    for (let node = el; node && node.nodeType === 1 && node !== document.body; node = node.parentElement) {
+        if (node !== el && node.id && unique('#' + esc(node.id))) { parts.unshift('#' + esc(node.id)); break; }
+        let part = node.tagName.toLowerCase();
+        const parent = node.parentElement;
+        if (parent) {
+            const same = Array.from(parent.children).filter(c => c.tagName === node.tagName);
+            if (same.length > 1) part += `:nth-of-type(${same.indexOf(node) + 1})`;
+        }
+        parts.unshift(part);
+    }
+    if (!parts.length || !parts[0].startsWith('#')) parts.unshift('body');
+    return {...info, selector: parts.join(' > ')};
+}
+"""
+
+class MacroRecorder:
+    """Captures the resolved action trace (URL, selector, action, value) of commands."""
+
+    def __init__(self):
+        self.active = False
+        self.steps = []
+        self.capture = None
+        self.command = None
+        self.command_id = 0
+
+    def start(self):
+        self.active = True
+        self.steps = []
+
+    def stop(self):
+        self.active = False
+        return self.steps
+
+    def begin_command(self, command):
+        self.command = command
+        self.command_id += 1
+
+    def _append(self, step):
+        step["command"] = self.command
+        step["command_id"] = self.command_id
+        if self.capture is not None:
+            self.capture.append(step)
+        elif self.active:
+            self.steps.append(step)
+
+    def describe(self, elem):
+        """Resolve elem to a replayable description, or None when nothing is being
+        recorded. Called before acting, since a click or Enter may leave the page."""
+        if not self.active and self.capture is None:
+            return None
+        # A Locator would wait for its element; it is about to be acted on, so it is there
+        options = {} if hasattr(elem, "owner_frame") else {"timeout": stage_timeout(2000)}
+        try:
+            return (yield elem.evaluate(DESCRIBE_ELEMENT_JS, **options))
+        except Exception as e:
+            print(f"[Macro] Could not describe element: {e}")
+            return None
+
+    def commit(self, action, info, value=None):
+        """Add a step described before its action, once the action succeeded."""
+        if info is not None and (self.active or self.capture is not None):
+            self._append_step(action, info, value)
+
+    def record(self, action, elem, value=None):
+        info = yield from self.describe(elem)
+        self.commit(action, info, value)
+
+    def _append_step(self, action, info, value):
+        step = {"action": action, "url": info["url"], "selector": info["selector"], "text": info["text"],
+                "label": info.get("label"), "value": value}
+        if info["secret"]:
+            # Never write passwords to disk; they are asked for again on replay
+            step["value"] = None
+            step["secret"] = True
+        self._append(step)
+
+    def record_goto(self, url):
+        if self.active or self.capture is not None:
+            self._append({"action": "goto", "url": url, "selector": None, "text": None, "value": None})
+
+class ThreadScoped:
+    """Proxy to one instance per thread, so concurrent API sessions don't share
+    handle generations or macro recordings."""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._local = threading.local()
+
+    def _get(self):
+        obj = getattr(self._local, "obj", None)
+        if obj is None:
+            obj = self._local.obj = self._factory()
+        return obj
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+    def __setattr__(self, name, value):
+        if name.startswith("_"):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._get(), name, value)
+
+recorder = ThreadScoped(MacroRecorder)
+
+class SessionState:
+    """What one command thread (the voice loop or an API session) carries between
+    commands: the last action for follow-ups, and where secrets
+    come from. API sessions have no terminal, so their secrets arrive with the command."""
+
+    def __init__(self):
+        self.last_action = None
+        self.interactive = True
+        self.secrets = {}
+
+session_state = ThreadScoped(SessionState)
+
+def ask_secret(key, prompt):
+    """A secret (login, macro password step) from the command's secrets, else from stdin."""
+    value = session_state.secrets.get(key)
+    if value is not None:
+        return value
+    if not session_state.interactive:
+        raise SecretUnavailable(f"'{key}' was not supplied with the command")
+    return (yield offload(input, prompt))
+
+def _secret_key(step):
+    return (step.get("label") or step.get("text") or "password").strip().lower()
+
+def secrets_needed(command):
+    """Secret names a command will ask for: 'login' needs a username and password,
+    a macro needs one per recorded password step."""
+    text = command.strip().lower()
+    if text.split()[:1] == ["login"]:
+        return ["username", "password"]
+    match = re.match(r"(?:run|replay) macro (.+)", text)
+    if match:
+        steps = load_macros().get(match.group(1).strip(), [])
+        return list(dict.fromkeys(_secret_key(step) for step in steps if step.get("secret")))
+    return []
+
+def load_macros():
+    try:
+        with open(MACRO_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"[Macro] Could not read {MACRO_FILE}: {e}")
+        return {}
+
+def save_macro(name, steps):
+    """Compile a recorded trace into a named macro: consecutive edits of the same
+    field collapse to the final value."""
+    compiled = []
+    for step in steps:
+        prev = compiled[-1] if compiled else None
+        if prev and step["action"] in ("type", "select", "check") and prev["action"] == step["action"] \
+                and prev["selector"] == step["selector"]:
+            compiled[-1] = step
+            continue
+        compiled.append(step)
+    macros = load_macros()
+    macros[name] = compiled
+    with open(MACRO_FILE, "w", encoding="utf-8") as f:
+        json.dump(macros, f, indent=2)
+    return compiled
+
+def _replay_step(page, step, loc):
+    value = step.get("value")
+    if step.get("secret"):
+        value = yield from ask_secret(_secret_key(step), f"Enter value for {step.get('text') or step['selector']}: ")
+    if step["action"] == "click":
+        yield from click_element(loc)
+    elif step["action"] == "type":
+        yield from type_into(loc, value or "")
+    elif step["action"] == "press":
+        yield from press_key(loc, value)
+    elif step["action"] == "select":
+        yield loc.select_option(value=value, timeout=stage_timeout(30000))
+        yield from recorder.record("select", loc, value)
+    elif step["action"] == "check":
+        yield loc.set_checked(value == "true", timeout=stage_timeout(30000))
+        yield from recorder.record("check", loc, value)
+
+def _step_ready(page, step, loc):
+    """Whether a recorded step's element is there, after giving a navigation from
+    the previous step time to land on the step's page and render it."""
+    # Query strings (session ids, tracking) vary between runs; only origin and path
+    # say whether the previous step's navigation has landed yet
+    page_of = lambda url: urlparse(url or "")._replace(params="", query="", fragment="").geturl()
+    target = page_of(step.get("url"))
+    if page_of(page.url) != target:
+        try:
+            yield page.wait_for_url(lambda url: page_of(url) == target, timeout=stage_timeout(MACRO_STEP_WAIT_MS))
+        except Exception:
+            # Redirects vary between runs too; the element check decides
+            pass
+    try:
+        yield page.wait_for_load_state("domcontentloaded", timeout=stage_timeout(MACRO_STEP_WAIT_MS))
+        # Strict: a selector that now matches several elements has drifted too
+        yield loc.wait_for(state="visible", timeout=stage_timeout(MACRO_STEP_WAIT_MS))
+        return True
+    except Exception:
+        return False
+
+def _relocate(page, step):
+    """Find the element a drifted step meant by its recorded text (clicks) or field
+    label (typing, keys, choices)."""
+    if step["action"] == "click":
+        text = step.get("text")
+        if not text:
+            return None
+        elem = yield first_of(
+            shown(page.get_by_role("button", name=text)),
+            shown(page.get_by_role("link", name=text)),
+            shown(page.get_by_text(text, exact=True).first),
+        )
+        if elem:
+            return elem
+        clickable = yield from harvest_clickables(page)
+        ranked = rank_click_targets(text, [t for t, _ in clickable])
+        return clickable[ranked[0]][1] if ranked is not None else None
+    label = step.get("label") or step.get("text")
+    if not label:
+        return None
+    return (yield from find_element_smart(page, [], field_name=label))
+
+def run_macro(page, name):
+    """Replay a macro without LLM calls. A step whose selector no longer resolves is
+    found again by its text or label, replayed alone and healed in the macro."""
+    macros = load_macros()
+    steps = macros.get(name)
+    if not steps:
+        print(f"No macro named '{name}'.")
+        speak(f"No macro named {name}.")
+        return False
+    was_active = recorder.active
+    recorder.active = False
+    healed = []
+    try:
+        for i, step in enumerate(steps):
+            if deadline_expired():
+                print(f"[Macro] Budget used up at step {i + 1}.")
+                speak("Macro stopped, it took too long.")
+                return False
+            if step["action"] == "goto":
+                yield page.goto(step["url"], timeout=stage_timeout(30000))
+                healed.append(step)
+                continue
+            loc = page.locator(step["selector"])
+            if (yield from _step_ready(page, step, loc)):
+                yield from _replay_step(page, step, loc)
+                healed.append(step)
+                continue
+            # Drifted: find this one element again and keep the selector it resolves to
+            print(f"[Macro] Step {i + 1} drifted ({step['selector']}), re-resolving it...")
+            elem = yield from _relocate(page, step)
+            recorder.capture = []
+            try:
+                if elem is not None:
+                    yield from _replay_step(page, step, elem)
+                captured = recorder.capture
+            finally:
+                recorder.capture = None
+            if not captured:
+                print(f"[Macro] Could not re-resolve step {i + 1}.")
+                speak(f"Macro {name} failed at step {i + 1}.")
+                return False
+            new = captured[-1]
+            healed.append(dict(step, url=new["url"], selector=new["selector"], text=new["text"], label=new["label"]))
+    finally:
+        recorder.active = was_active
+    if healed != steps:
+        macros[name] = healed
+        with open(MACRO_FILE, "w", encoding="utf-8") as f:
+            json.dump(macros, f, indent=2)
+        print(f"[Macro] Updated drifted steps in '{name}'.")
+    print(f"Macro '{name}' finished ({len(steps)} steps).")
+    speak(f"Macro {name} finished.")
+    return True
+
+# Matches each requested field name to the best visible form control and sets all
+# values in one pass, firing input/change events so frameworks see the update.
+FILL_FORM_JS = r"""
+(pairs) => {
+    const clean = t => (t || '').replace(/\s+/g, ' ').trim().toLowerCase();
+    const words = t => clean(t).split(/[^a-z0-9]+/).filter(Boolean);
+    const visible = el => el.getClientRects().length > 0 && getComputedStyle(el).visibility !== 'hidden';
+    const controls = Array.from(document.querySelectorAll('input, textarea, select')).filter(el =>
+        visible(el) && !el.disabled && !['hidden', 'submit', 'button', 'image', 'reset', 'file'].includes(el.type));
+    const describe = el => [
+        ...(el.labels ? Array.from(el.labels).map(l => l.innerText) : []),
+        el.getAttribute('aria-label'), el.getAttribute('placeholder'), el.name, el.id,
+        el.getAttribute('autocomplete'), el.type,
+    ].map(clean).filter(Boolean);
+    const score = (field, el) => {
+        const target = clean(field), fw = words(field);
+        let best = 0;
+        for (const d of describe(el)) {
+            if (d === target) best = Math.max(best, 1);
+            else if (d.includes(target) || target.includes(d)) best = Math.max(best, 0.8);
+            else {
+                const dw = words(d);
+                const overlap = fw.filter(w => dw.some(x => x.startsWith(w) || w.startsWith(x))).length;
+                if (overlap) best = Math.max(best, 0.6 * overlap / fw.length);
+            }
+        }
+        return best;
+    };
+    const kindOf = el => el.tagName === 'SELECT' ? 'select' : (el.type === 'checkbox' || el.type === 'radio') ? 'check' : 'text';
+    // Returns the value as a replay would set it: option value, "true"/"false" or the text
+    const setValue = (el, value) => {
+        let applied = value;
+        if (el.tagName === 'SELECT') {
+            const opt = Array.from(el.options).find(o => clean(o.text) === clean(value) || clean(o.value) === clean(value))
+                || Array.from(el.options).find(o => clean(o.text).includes(clean(value)));
+            if (!opt) return null;
+            el.value = applied = opt.value;
+        } else if (el.type === 'checkbox' || el.type === 'radio') {
+            el.checked = ['yes', 'true', 'on', 'check', 'checked', '1'].includes(clean(value));
+            applied = String(el.checked);
+        } else {
+            const proto = el.tagName === 'TEXTAREA' ? HTMLTextAreaElement.prototype : HTMLInputElement.prototype;
+            Object.getOwnPropertyDescriptor(proto, 'value').set.call(el, value);
+        }
+        el.dispatchEvent(new Event('input', {bubbles: true}));
+        el.dispatchEvent(new Event('change', {bubbles: true}));
+        return applied;
+    };
+    const used = new Set();
+    return pairs.map(([field, value], i) => {
+        let best = null, bestScore = 0.3;
+        for (const el of controls) {
+            if (used.has(el)) continue;
+            const s = score(field, el);
+            if (s > bestScore) { best = el; bestScore = s; }
+        }
+        if (!best) return {field, ok: false};
+        used.add(best);
+        best.setAttribute('data-bot-fill', String(i));
+        const applied = setValue(best, value);
+        return {field, ok: applied !== null, kind: kindOf(best), value: applied, selector: `[data-bot-fill="${i}"]`, score: bestScore};
+    });
+}
+"""
+
+# The names a control answers to, as FILL_FORM_JS matches them
+FORM_LABELS_JS = r"""
+() => Array.from(document.querySelectorAll('input, textarea, select'))
+    .filter(el => el.getClientRects().length > 0 && !el.disabled && !['hidden', 'submit', 'button', 'image', 'reset', 'file'].includes(el.type))
+    .flatMap(el => [
+        ...(el.labels ? Array.from(el.labels).map(l => l.innerText) : []),
+        el.getAttribute('aria-label'), el.getAttribute('placeholder'), el.name, el.id, el.getAttribute('autocomplete'),
+    ])
+    .map(t => (t || '').replace(/\s+/g, ' ').trim().toLowerCase())
+    .filter(Boolean)
+"""
+
+def _names_field(field, labels):
+    """True when a spoken field name plausibly refers to one of the form's labels."""
+    if labels is None:
+        return True
+    words = re.findall(r"[a-z0-9]+", field.lower())
+    for label in labels:
+        label_words = re.findall(r"[a-z0-9]+", label)
+        if field.lower() in label or label in field.lower() or any(
+                w.startswith(x) or x.startswith(w) for w in words for x in label_words if min(len(w), len(x)) > 2):
+            return True
+    return False
+
+def parse_form_pairs(text, labels=None):
+    """'email is a@b.com, name is John and city is Pune' -> [(field, value), ...]
+    With the form's labels, only a name that matches one starts a new field."""
+    # A new field is a short name (up to three words) directly before "is", "=" or ":"
+    field = r"(?:[\w'-]+\s+){0,2}[\w'-]+\s*(?:\bis\b|=|:)"
+    parts = re.split(rf"(,\s*(?:and\s+)?|;\s*|\s+and\s+)(?={field})", text, flags=re.IGNORECASE)
+    pairs = []
+    separator = ""
+    for i, part in enumerate(parts):
+        if i % 2:
+            separator = part
+            continue
+        match = re.match(r"\s*((?:[\w'-]+\s+){0,2}[\w'-]+)\s*(?:\bis\b|=|:)\s*(.+?)\s*$", part, re.IGNORECASE)
+        if match and (not pairs or _names_field(match.group(1), labels)):
+            pairs.append((match.group(1), match.group(2)))
+        elif pairs:
+            # "Hi, this is Bob calling": not a field, so it belongs to the value before it
+            pairs[-1] = (pairs[-1][0], pairs[-1][1] + separator + part.rstrip())
+    return pairs
+
+def fill_form(page, pairs):
+    """Fill several fields in one in-page call; hosts in TYPE_SITES get real key events."""
+    yield page.evaluate("() => document.querySelectorAll('[data-bot-fill]').forEach(el => el.removeAttribute('data-bot-fill'))")
+    results = yield page.evaluate(FILL_FORM_JS, [list(pair) for pair in pairs])
+    needs_keys = input_mode_for(page.url) != "fill"
+    for (field, value), result in zip(pairs, results):
+        if not result.get("selector") or not result.get("ok"):
+            continue
+        loc = page.locator(result["selector"])
+        kind = result.get("kind", "text")
+        if kind == "text" and needs_keys:
+            yield from type_into(loc, value)
+        else:
+            # Recorded as the action a replay performs: type, select (option value) or check
+            yield from recorder.record("type" if kind == "text" else kind, loc, result.get("value", value))
+    return results
+
+class HandleManager:
+    """Owns every ElementHandle the bot creates. Handles are grouped by navigation
+    generation: a main-frame navigation makes the previous generation stale and it
+    is disposed at the start of the next command. At most MAX_LIVE_HANDLES stay
+    alive; anything kept across commands is stored as a Locator instead."""
+
+    def __init__(self, max_handles):
+        self.max_handles = max_handles
+        self.generation = 0
+        self.live = collections.deque()
+        self.disposed = 0
+        self.lock = threading.Lock()
+
+    def track(self, handle):
+        if handle is not None:
+            with self.lock:
+                self.live.append((self.generation, handle))
+        return handle
+
+    def track_all(self, handles):
+        for handle in handles:
+            self.track(handle)
+        return handles
+
+    def on_navigation(self, frame):
+        if frame.parent_frame is None:
+            with self.lock:
+                self.generation += 1
+
+    def sweep(self):
+        """Between commands: dispose handles from earlier generations, then the
+        oldest ones beyond the cap."""
+        with self.lock:
+            stale = [h for gen, h in self.live if gen < self.generation]
+            self.live = collections.deque((gen, h) for gen, h in self.live if gen >= self.generation)
+            while len(self.live) > self.max_handles:
+                stale.append(self.live.popleft()[1])
+        yield from self._dispose(stale)
+
+    def _dispose(self, stale):
+        for handle in stale:
+            try:
+                yield handle.dispose()
+            except Exception:
+                # The handle's document is already gone
+                pass
+            self.disposed += 1
+
+    def report(self, page):
+        info = {"generation": self.generation, "live_handles": len(self.live), "disposed_handles": self.disposed}
+        try:
+            info.update((yield page.evaluate(
+                "() => ({dom_nodes: document.getElementsByTagName('*').length,"
+                " js_heap_mb: performance.memory ? +(performance.memory.usedJSHeapSize / 1048576).toFixed(1) : null})"
+            )))
+        except Exception:
+            pass
+        if psutil is not None:
+            proc = psutil.Process()
+            info["python_rss_mb"] = round(proc.memory_info().rss / 1048576, 1)
+            try:
+                info["browser_rss_mb"] = round(sum(c.memory_info().rss for c in proc.children(recursive=True)) / 1048576, 1)
+            except Exception:
+                pass
+        return info
+
+handles = ThreadScoped(lambda: HandleManager(MAX_LIVE_HANDLES))
+
+def watch_navigation(page):
+    page.on("framenavigated", handles.on_navigation)
+
+TITLE_KEYS = ("title", "name", "headline", "label", "displayname", "productname", "text")
+URL_KEYS = ("url", "link", "href", "permalink", "canonical_url", "canonicalurl", "weburl", "web_url", "uri", "path")
+
+def _json_text(value):
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, dict):
+        # {"simpleText": ...} / {"runs": [{"text": ...}]} style rich text
+        if isinstance(value.get("simpleText"), str):
+            return value["simpleText"].strip()
+        runs = value.get("runs")
+        if isinstance(runs, list):
+            return "".join(r.get("text", "") for r in runs if isinstance(r, dict)).strip()
+    return ""
+
+def _json_record(obj, base_url):
+    keys = {k.lower(): k for k in obj}
+    title = next((t for t in (_json_text(obj[keys[k]]) for k in TITLE_KEYS if k in keys) if t), "")
+    if not title or len(title) > 300:
+        return None
+    url = None
+    for k in URL_KEYS:
+        value = obj.get(keys.get(k))
+        if isinstance(value, str) and (value.startswith("http") or value.startswith("/")):
+            url = urljoin(base_url, value)
+            break
+    row = {"title": title, "url": url}
+    for k, v in obj.items():
+        if isinstance(v, (str, int, float, bool)) and k not in row:
+            row[k] = v
+    return row
+
+def json_result_records(data, base_url, depth=0):
+    """Result-like records from a JSON body: the first lists of objects that mostly
+    carry a title field, searched breadth-first through nested objects."""
+    if depth > 6:
+        return []
+    if isinstance(data, list):
+        objs = [d for d in data if isinstance(d, dict)]
+        if len(objs) >= 2:
+            rows = [r for r in (_json_record(o, base_url) for o in objs) if r]
+            if len(rows) * 2 >= len(objs):
+                return rows
+        children = data[:50]
+    elif isinstance(data, dict):
+        children = [v for v in data.values() if isinstance(v, (list, dict))]
+    else:
+        return []
+    records = []
+    for child in children:
+        records.extend(json_result_records(child, base_url, depth + 1))
+    return records
+
+class ResultCapture:
+    """Records parsed from matching JSON responses of one page. A new document
+    request or a main-frame URL change (SPA pushState) clears them; XHR/fetch
+    responses after it append, deduplicated."""
+
+    def __init__(self, patterns, max_items):
+        self.patterns = patterns
+        self.max_items = max_items
+        self.items = []
+        self.arrived = []
+        self.seen = set()
+        self.url = None
+        self.lock = threading.Lock()
+
+    def wants(self, url, resource_type, headers):
+        if resource_type not in ("xhr", "fetch") or "json" not in headers.get("content-type", ""):
+            return False
+        if int(headers.get("content-length") or 0) > CAPTURE_MAX_BYTES:
+            return False
+        return any(fnmatch.fnmatch(url, pattern) for pattern in self.patterns)
+
+    def clear(self):
+        with self.lock:
+            self.items = []
+            self.arrived = []
+            self.seen = set()
+
+    def navigated(self, url):
+        """Main frame now shows url. On a change, keep only records that arrived in
+        the last CAPTURE_NAV_GRACE seconds: they belong to the view being shown."""
+        with self.lock:
+            if url == self.url:
+                return
+            self.url = url
+            recent = time.monotonic() - CAPTURE_NAV_GRACE
+            kept = [(item, t) for item, t in zip(self.items, self.arrived) if t >= recent]
+            self.items = [item for item, _ in kept]
+            self.arrived = [t for _, t in kept]
+            self.seen = {(item["url"] or "", item["title"]) for item in self.items}
+
+    def feed(self, url, data):
+        added = 0
+        with self.lock:
+            for record in json_result_records(data, url):
+                key = (record["url"] or "", record["title"])
+                if key in self.seen or len(self.items) >= self.max_items:
+                    continue
+                self.seen.add(key)
+                self.items.append(record)
+                self.arrived.append(time.monotonic())
+                added += 1
+        if added:
+            print(f"[Capture] {added} results from {urlparse(url).path}")
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.items)
+
+def _is_main_document(request):
+    try:
+        return request.is_navigation_request() and request.frame.parent_frame is None
+    except Exception:
+        return False
+
+def watch_responses(page):
+    """Capture search results from JSON responses matching CAPTURE_RESPONSES."""
+    capture = ResultCapture(CAPTURE_RESPONSES, CAPTURE_MAX_ITEMS)
+    page._bot_results = capture
+
+    def on_request(request):
+        if _is_main_document(request):
+            capture.clear()
+
+    def on_navigated(frame):
+        if frame.parent_frame is None:
+            capture.navigated(frame.url)
+
+    def on_response(response):
+        if not capture.wants(response.url, response.request.resource_type, response.headers):
+            return
+        try:
+            data = yield response.json()
+        except Exception:
+            return
+        capture.feed(response.url, data)
+
+    # Events arrive outside any command, so the handler drives its own flow
+    run = run_async if isinstance(page, AsyncPage) else run_sync
+    page.on("request", on_request)
+    page.on("framenavigated", on_navigated)
+    page.on("response", lambda response: run(on_response(response)))
+
+def captured_results(page):
+    capture = getattr(page, "_bot_results", None)
+    return capture.snapshot() if capture is not None else []
+
+def pick_result(records, user_input):
+    """Pick a captured record by ordinal ("second", "3rd") or fuzzy title."""
+    idx = extract_ordinal(user_input)
+    if idx is not None:
+        return records[idx] if idx < len(records) else None
+    _, record = fuzzy_match_title(user_input, [(i, r["title"], r) for i, r in enumerate(records)])
+    return record
+
+def _css_string(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+def open_result(page, record):
+    """Follow a captured result: click its link when it is on the page (keeps the
+    site's own routing), otherwise navigate to its URL."""
+    url = record.get("url")
+    candidates = []
+    if url:
+        path = urlparse(url).path
+        candidates.append(page.locator(f'a[href="{_css_string(url)}"], a[href="{_css_string(path)}"]').first)
+    candidates.append(page.get_by_role("link", name=record["title"]).first)
+    for loc in candidates:
+        try:
+            if (yield loc.is_visible()):
+                yield from click_element(loc)
+                return True
+        except Exception:
+            continue
+    if url:
+        yield page.goto(url, timeout=stage_timeout(30000))
+        recorder.record_goto(page.url)
+        return True
+    return False
+
+def as_locator(elem):
+    """Swap a live ElementHandle for a Locator descriptor that survives disposal."""
+    if not hasattr(elem, "owner_frame"):
+        return elem
+    try:
+        selector = (yield elem.evaluate(DESCRIBE_ELEMENT_JS))["selector"]
+        return (yield elem.owner_frame()).locator(selector)
+    except Exception:
+        return None
+
+def run_command(page, command):
+    tokens = command.lower().split()
+    if not tokens:
+        return
+    yield from handles.sweep()
+    recorder.begin_command(command)
+    # Every stage below takes its timeout from this command's budget
+    with command_deadline(tokens[0]):
+        yield from _run_command(page, command, tokens)
+
+def shown_as(how, elem):
+    """(how, elem) when elem is visible, for lookups that report which probe matched."""
+    return (how, elem) if (yield from shown(elem)) else None
+
+def _run_command(page, command, tokens):
+    # Macro commands: "start recording", "stop recording", "save macro <name>", "run macro <name>"
+    if command.strip().lower() in ["start recording", "record macro"]:
+        recorder.start()
+        print("Recording started.")
+        speak("Recording started.")
+        return
+    if command.strip().lower() == "stop recording":
+        steps = recorder.stop()
+        print(f"Recording stopped with {len(steps)} steps. Say 'save macro <name>' to keep it.")
+        speak(f"Recording stopped with {len(steps)} steps.")
+        return
+    match = re.match(r"save macro (.+)", command, re.IGNORECASE)
+    if match:
+        name = match.group(1).strip().lower()
+        steps = recorder.stop()
+        if not steps:
+            print("Nothing recorded yet.")
+            speak("Nothing recorded yet.")
+            return
+        compiled = save_macro(name, steps)
+        print(f"Saved macro '{name}' with {len(compiled)} steps.")
+        speak(f"Saved macro {name}.")
+        return
+    if command.strip().lower() in ["memory report", "memory status"]:
+        info = yield from handles.report(page)
+        print(f"[Memory] {info}")
+        speak(f"{info['live_handles']} live element handles, {info.get('dom_nodes', 'unknown')} DOM nodes.")
+        return
+    match = re.match(r"(?:run|replay) macro (.+)", command, re.IGNORECASE)
+    if match:
+        yield from run_macro(page, match.group(1).strip().lower())
+        return
+    if command.strip().lower() == "list macros":
+        names = list(load_macros())
+        print(f"Macros: {', '.join(names) if names else 'none'}")
+        speak(f"You have {len(names)} macros.")
+        return
+    if command.strip().lower() == "start tracing":
+        started = yield from start_trace(page)
+        print("Tracing started." if started else "Tracing is already on.")
+        speak("Tracing started." if started else "Tracing is already on.")
+        return
+    if command.strip().lower() == "stop tracing":
+        path = yield from stop_trace(page)
+        print(f"Trace saved to {path}" if path else "Tracing is not on.")
+        speak("Trace saved." if path else "Tracing is not on.")
+        return
+
+    if tokens[0] == "open" and len(tokens) > 1:
+        url = tokens[1]
+        if not url.startswith("http"):
+            if '.' not in url:
+                url += ".com"
+                url = "https://" + url
+            else:
+                url = "https://" + url
+        try:
+            yield page.goto(url, timeout=stage_timeout(30000))
+            recorder.record_goto(page.url)
+            print(f"Opened {url}")
+            speak(f"Opened {url}")
+        except Exception as e:
+            print(f"[ERROR] Failed to open {url}: {e}")
+            speak(f"Failed to open {url}.")
+            yield from save_debug_info(page, "open_url")
+        return
+
+    if tokens[0] == "search":
+        search_term = " ".join(tokens[1:])
+        search_box = yield from shown(page.get_by_role("searchbox"))
+        if not search_box:
+            search_bar_selectors = [
+                'input[type="search"]', 'input[name*="search"]', 'input[id*="search"]',
+                'input[placeholder*="Search"]', 'input[aria-label*="Search"]',
+                'input[type="text"]'
+            ]
+            search_box = yield from find_element_smart(page, search_bar_selectors, field_name="Search")
+        if search_box:
+            try:
+                yield from type_into(search_box, search_term)
+                yield from press_key(search_box, 'Enter')
+                print("Search submitted.")
+                speak("Search submitted.")
+            except Exception as e:
+                print(f"[ERROR] Failed to type/search: {e}")
+                speak("Failed to submit search.")
+                yield from save_debug_info(page, "search")
             return
         print("No search bar found after waiting.")
         speak("No search bar found.")
-        save_debug_info(page, "search_not_found")
+        yield from save_debug_info(page, "search_not_found")
         return
 
     if tokens[0] == "login":
-        username = input("Enter username: ")
-        password = input("Enter password: ")
-        user_field = find_element_smart(page, [
+        username = yield from ask_secret("username", "Enter username: ")
+        password = yield from ask_secret("password", "Enter password: ")
+        user_field = yield from find_element_smart(page, [
             'input[type="email"]', 'input[name*="email"]', 'input[id*="email"]',
             'input[type="text"]', 'input[name*="user"]', 'input[id*="user"]'
         ], field_name="Username")
         if not user_field:
-            user_field = find_element_smart(page, [
+            user_field = yield from find_element_smart(page, [
                 'input[type="email"]', 'input[name*="email"]', 'input[id*="email"]',
                 'input[type="text"]', 'input[name*="user"]', 'input[id*="user"]'
             ], field_name="Email")
-        pass_field = find_element_smart(page, [
+        pass_field = yield from find_element_smart(page, [
             'input[type="password"]', 'input[name*="pass"]', 'input[id*="pass"]'
         ], field_name="Password")
-        submit_btn = None
-        try:
-            submit_btn = page.get_by_role("button", name="Login")
-            if not submit_btn or not submit_btn.is_visible():
-                submit_btn = None
-        except Exception:
-            pass
+        submit_btn = yield from shown(page.get_by_role("button", name="Login"))
         if not submit_btn:
-            submit_btn = find_element_smart(page, [
+            submit_btn = yield from find_element_smart(page, [
                 'button[type="submit"]', 'input[type="submit"]', 'button', 'input[type="button"]'
             ], field_name="Login")
         if user_field and pass_field:
             try:
-                user_field.fill("")
-                user_field.type(username)
-                pass_field.fill("")
-                pass_field.type(password)
+                yield from type_into(user_field, username)
+                yield from type_into(pass_field, password)
                 if submit_btn:
-                    submit_btn.click()
+                    yield from click_element(submit_btn)
                     print("Login attempted.")
                     speak("Login attempted.")
             except Exception as e:
                 print(f"[ERROR] Failed to fill login fields: {e}")
                 speak("Login failed.")
-                save_debug_info(page, "login")
+                yield from save_debug_info(page, "login")
             return
         print("Could not find login fields/buttons automatically.")
         speak("Could not find login fields or buttons automatically.")
-        save_debug_info(page, "login_not_found")
+        yield from save_debug_info(page, "login_not_found")
+        return
+
+    # Fill several fields at once: "fill form email is a@b.com, name is John"
+    match = re.match(r"fill (?:the )?form (?:with )?(.+)", command, re.IGNORECASE)
+    if match:
+        try:
+            labels = yield page.evaluate(FORM_LABELS_JS)
+        except Exception:
+            labels = None
+        pairs = parse_form_pairs(match.group(1), labels)
+        if not pairs:
+            print("Say the fields as 'fill form <field> is <value>, <field> is <value>'.")
+            speak("Please say each field and its value.")
+            return
+        try:
+            results = yield from fill_form(page, pairs)
+        except Exception as e:
+            print(f"[ERROR] Failed to fill form: {e}")
+            speak("Could not fill the form.")
+            yield from save_debug_info(page, "fill_form")
+            return
+        filled = [r["field"] for r in results if r.get("ok")]
+        missed = [r["field"] for r in results if not r.get("ok")]
+        print(f"Filled {len(filled)} of {len(results)} fields." + (f" Not found: {', '.join(missed)}" if missed else ""))
+        speak(f"Filled {len(filled)} fields." + (f" Could not find {', '.join(missed)}." if missed else ""))
         return
 
     # Type in field: "type <text> in <field>"
@@ -430,76 +2863,49 @@ def handle_command(page, command):
         if sel_match:
             selector = sel_match.group(1).strip()
             try:
-                field_elem = page.wait_for_selector(selector, timeout=5000)
-                field_elem.fill("")
-                field_elem.type(text)
+                field_elem = handles.track((yield page.wait_for_selector(selector, timeout=stage_timeout(5000))))
+                yield from type_into(field_elem, text)
                 print(f"Typed '{text}' in selector '{selector}'.")
-                speak(f"Typed {text} in the selected field.")
+                speak(f"Typed {text} in the selected field.", cache=False)
                 return
             except PlaywrightTimeoutError:
                 print("Element not found or not interactable after waiting.")
                 speak("Element not found or not interactable after waiting.")
                 return
         # Try robust selectors first
-        try:
-            field_elem = page.get_by_label(field)
-            if field_elem and field_elem.is_visible():
-                field_elem.fill("")
-                field_elem.type(text)
-                print(f"Typed '{text}' in field '{field}' by label.")
-                speak(f"Typed {text} in {field}.")
-                return
-        except Exception:
-            pass
-        try:
-            field_elem = page.get_by_test_id(field)
-            if field_elem and field_elem.is_visible():
-                field_elem.fill("")
-                field_elem.type(text)
-                print(f"Typed '{text}' in field '{field}' by test id.")
-                speak(f"Typed {text} in {field}.")
-                return
-        except Exception:
-            pass
-        try:
-            field_elem = page.get_by_role("textbox", name=field)
-            if field_elem and field_elem.is_visible():
-                field_elem.fill("")
-                field_elem.type(text)
-                print(f"Typed '{text}' in field '{field}' by role.")
-                speak(f"Typed {text} in {field}.")
+        found = yield first_of(
+            shown_as("label", page.get_by_label(field)),
+            shown_as("test id", page.get_by_test_id(field)),
+            shown_as("role", page.get_by_role("textbox", name=field)),
+        )
+        if found:
+            how, field_elem = found
+            try:
+                yield from type_into(field_elem, text)
+                print(f"Typed '{text}' in field '{field}' by {how}.")
+                speak(f"Typed {text} in {field}.", cache=False)
                 return
-        except Exception:
-            pass
+            except Exception:
+                pass
         # AI + heuristics fallback
         print(f"Trying to type '{text}' in '{field}' (AI + heuristics fallback)...")
-        speak(f"Trying to type {text} in {field} using AI and heuristics.")
-        html = page.content()
+        speak(f"Trying to type {text} in {field} using AI and heuristics.", cache=False)
+        html = yield from prompt_html(page)
         prompt = (
-            f"Given the following HTML, what is the best Playwright-compatible CSS selector to find the field for '{field}'? "
-            f"Respond with only the selector string, no explanation, no code block, no curly braces.\nHTML:\n" + html[:3000]
+            f"Given the following HTML, what are the best Playwright-compatible CSS selectors to find the field for '{field}'? "
+            + selector_list_instructions(["#search", "input[name='q']"]) + "\nHTML:\n" + html[:3000]
         )
-        selector = None
         try:
-            response = client.chat.completions.create(
-                model=MODEL,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0,
-                max_tokens=100,
-            )
-            print(f"AI raw response: {response}")
-            ai_content = response.choices[0].message.content.strip()
-            selector = extract_selector(ai_content)
-            print(f"AI suggested selector: {selector}")
-            try:
-                field_elem = page.wait_for_selector(selector, timeout=5000)
-                field_elem.fill("")
-                field_elem.type(text)
+            ai_content = yield offload(llm.complete, prompt, route="selector")
+            candidates = selector_candidates(ai_content)
+            print(f"AI suggested selectors: {candidates}")
+            best = yield from best_ai_selector(page, candidates, field, "type")
+            if best:
+                yield from type_into(best[1], text)
                 print(f"Typed '{text}' in '{field}'.")
-                speak(f"Typed {text} in {field}.")
+                speak(f"Typed {text} in {field}.", cache=False)
                 return
-            except PlaywrightTimeoutError:
-                print("AI selector did not work, trying heuristics...")
+            print("AI selectors did not work, trying heuristics...")
         except Exception as e:
             print(f"AI error: {e}")
             print("Trying heuristics...")
@@ -533,32 +2939,42 @@ def handle_command(page, command):
                 'input[type="text"]', 'textarea'
             ]
         for sel in heuristics:
+            if deadline_expired():
+                break
             try:
-                field_elem = page.wait_for_selector(sel, timeout=2000)
-                if field_elem and field_elem.is_visible():
-                    field_elem.fill("")
-                    field_elem.type(text)
+                field_elem = handles.track((yield page.wait_for_selector(sel, timeout=stage_timeout(2000))))
+                if field_elem and (yield field_elem.is_visible()):
+                    yield from type_into(field_elem, text)
                     print(f"Typed '{text}' in '{field}' using heuristic selector '{sel}'.")
-                    speak(f"Typed {text} in {field}.")
+                    speak(f"Typed {text} in {field}.", cache=False)
                     return
             except PlaywrightTimeoutError:
                 continue
         # If all else fails, list visible input fields for user to pick
         print("Could not find the field automatically. Listing visible input fields:")
         speak("I could not find the field. Here are some visible fields. Say 'type ... in field number 1' to select.")
-        input_elems = page.query_selector_all('input, textarea')
         visible_fields = []
-        for i, elem in enumerate(input_elems):
-            try:
-                if elem.is_visible():
-                    label = elem.get_attribute('aria-label') or elem.get_attribute('placeholder') or elem.get_attribute('name') or elem.get_attribute('id') or f"input #{i}"
-                    visible_fields.append((i, label, elem))
-            except Exception:
-                continue
+        index = yield from get_page_index(page)
+        if index is not None:
+            for i, item in enumerate(index["inputs"]):
+                visible_fields.append((i, item["label"], page.locator(f'[data-bot-id="{item["id"]}"]')))
+        else:
+            input_elems = handles.track_all((yield page.query_selector_all('input, textarea')))
+            for i, elem in enumerate(input_elems):
+                try:
+                    if (yield elem.is_visible()):
+                        label = ((yield elem.get_attribute('aria-label')) or (yield elem.get_attribute('placeholder'))
+                                 or (yield elem.get_attribute('name')) or (yield elem.get_attribute('id')) or f"input #{i}")
+                        visible_fields.append((i, label, elem))
+                except Exception:
+                    continue
         for i, label, _ in visible_fields:
             print(f"Field #{i}: {label}")
             speak(f"Field number {i}: {label}")
-        page._input_field_suggestions = [elem for _, _, elem in visible_fields]
+        suggestions = []
+        for _, _, elem in visible_fields:
+            suggestions.append((yield from as_locator(elem)))
+        page._input_field_suggestions = suggestions
         return
 
     # Type in focused field: "type <text>"
@@ -567,13 +2983,12 @@ def handle_command(page, command):
         text = match.group(1)
         # Try to type in the currently focused field
         try:
-            focused = page.evaluate_handle("() => document.activeElement")
-            tag = focused.get_property("tagName").json_value().lower()
+            focused = handles.track((yield page.evaluate_handle("() => document.activeElement")))
+            tag = (yield (yield focused.get_property("tagName")).json_value()).lower()
             if tag in ["input", "textarea"]:
-                focused.fill("")
-                focused.type(text)
+                yield from type_into(focused, text)
                 print(f"Typed '{text}' in the focused field.")
-                speak(f"Typed {text} in the focused field.")
+                speak(f"Typed {text} in the focused field.", cache=False)
                 return
             else:
                 print("Focused element is not a text field.")
@@ -588,54 +3003,47 @@ def handle_command(page, command):
     if match_selector:
         selector = match_selector.group(1).strip()
         print(f"Trying to click element by selector: {selector}")
-        speak(f"Trying to click element by selector.")
+        speak("Trying to click element by selector.")
         try:
-            elem = page.wait_for_selector(selector, timeout=5000)
-            if elem and elem.is_visible():
-                try:
-                    elem.scroll_into_view_if_needed()
-                except Exception:
-                    pass
-                elem.click()
+            elem = handles.track((yield page.wait_for_selector(selector, timeout=stage_timeout(5000))))
+            if elem and (yield elem.is_visible()):
+                yield from click_element(elem)
                 print(f"Clicked element with selector: {selector}")
-                speak(f"Clicked element with selector.")
+                speak("Clicked element with selector.")
                 return
             else:
                 print("Element found but not visible.")
         except PlaywrightTimeoutError:
             print("Element not found or not clickable after waiting in main page. Trying iframes...")
-            # Try all iframes
-            frames = page.frames
-            for frame in frames:
+
+            def probe(frame):
+                if deadline_expired():
+                    return None
                 try:
-                    elem = frame.wait_for_selector(selector, timeout=2000)
-                    if elem and elem.is_visible():
-                        try:
-                            elem.scroll_into_view_if_needed()
-                        except Exception:
-                            pass
-                        elem.click()
-                        print(f"Clicked element with selector: {selector} in iframe.")
-                        speak(f"Clicked element with selector in iframe.")
-                        return
+                    elem = handles.track((yield frame.wait_for_selector(selector, timeout=stage_timeout(2000))))
+                    return elem if elem and (yield elem.is_visible()) else None
                 except Exception:
-                    continue
+                    return None
+
+            # The async engine searches every frame at once instead of 2 s per frame in turn
+            elem = yield first_of(*(probe(frame) for frame in page.frames))
+            if elem:
+                yield from click_element(elem)
+                print(f"Clicked element with selector: {selector} in iframe.")
+                speak("Clicked element with selector in iframe.")
+                return
             print("Element not found or not clickable after waiting in any frame.")
             speak("Element not found or not clickable after waiting.")
-            suggest_clickable_elements(page)
+            yield from suggest_clickable_elements(page)
         return
 
     # Click by suggestion number: click #<number>
     match_number = re.match(r"click #(\d+)", command, re.IGNORECASE)
     if match_number:
         idx = int(match_number.group(1))
-        if hasattr(page, "_clickable_suggestions") and 0 <= idx < len(page._clickable_suggestions):
+        if hasattr(page, "_clickable_suggestions") and 0 <= idx < len(page._clickable_suggestions) and page._clickable_suggestions[idx] is not None:
             elem = page._clickable_suggestions[idx]
-            try:
-                elem.scroll_into_view_if_needed()
-            except Exception:
-                pass
-            elem.click()
+            yield from click_element(elem)
             print(f"Clicked suggested element #{idx}.")
             speak(f"Clicked suggested element number {idx}.")
             return
@@ -644,163 +3052,130 @@ def handle_command(page, command):
             speak("No such suggestion.")
         return
 
-    # Click by visible text: click <something>
-    match_click = re.match(r"click (.+)", command, re.IGNORECASE)
-    if match_click:
-        target = match_click.group(1).strip()
-        # Try robust Playwright selectors first
-        try:
-            elem = page.get_by_role("button", name=target)
-            if elem and elem.is_visible():
-                try:
-                    elem.scroll_into_view_if_needed()
-                except Exception:
-                    pass
-                elem.click()
-                print(f"Clicked '{target}' using role selector.")
-                speak(f"Clicked {target}.")
-                return
-        except Exception:
-            pass
-        try:
-            elem = page.get_by_label(target)
-            if elem and elem.is_visible():
-                try:
-                    elem.scroll_into_view_if_needed()
-                except Exception:
-                    pass
-                elem.click()
-                print(f"Clicked '{target}' using label selector.")
-                speak(f"Clicked {target}.")
-                return
-        except Exception:
-            pass
-        try:
-            elem = page.get_by_test_id(target)
-            if elem and elem.is_visible():
-                try:
-                    elem.scroll_into_view_if_needed()
-                except Exception:
-                    pass
-                elem.click()
-                print(f"Clicked '{target}' using test id selector.")
-                speak(f"Clicked {target}.")
+    # Universal click item by ordinal or fuzzy title: 'click item <target>'
+    match_item = re.match(r"click item (.+)", command, re.IGNORECASE)
+    if match_item:
+        user_input = match_item.group(1).strip()
+        # Results captured from the site's JSON responses, when configured
+        records = captured_results(page)
+        if records:
+            record = pick_result(records, user_input)
+            if record and (yield from open_result(page, record)):
+                print(f"Clicked item: {record['title']}")
+                speak(f"Clicked item {record['title']}")
                 return
-        except Exception:
-            pass
-        # Try Playwright's text selector directly
-        try:
-            elem = page.locator(f'text="{target}"').first
-            if elem and elem.is_visible():
-                try:
-                    elem.scroll_into_view_if_needed()
-                except Exception:
-                    pass
-                elem.click()
-                print(f"Clicked '{target}' using text selector.")
+        idx = extract_ordinal(user_input)
+        if idx is not None:
+            items = yield from scroll_harvest(page, until_count=idx + 1)
+        else:
+            items = yield from scroll_harvest(page, until_match=user_input)
+        clickable = [(i, item["text"], item) for i, item in enumerate(items)]
+        # Try ordinal
+        if idx is not None and idx < len(clickable):
+            yield from click_harvested(page, clickable[idx][2])
+            print(f"Clicked item: {clickable[idx][1]}")
+            speak(f"Clicked item {clickable[idx][1]}")
+            return
+        # Try fuzzy match
+        idx, item = yield from choose_title(user_input, clickable)
+        if item:
+            yield from click_harvested(page, item)
+            print(f"Clicked item: {clickable[idx][1]}")
+            speak(f"Clicked item {clickable[idx][1]}")
+            return
+        # Fallback: list titles
+        print("Could not find a matching item. Here are the top results:")
+        speak("I couldn't find a matching item. Here are the top results.")
+        for i, text, _ in clickable[:5]:
+            print(f"{i+1}: {text}")
+            speak(f"Result {i+1}: {text}")
+        return
+
+    # Click by visible text: click <something>
+    match_click = re.match(r"click (.+)", command, re.IGNORECASE)
+    if match_click:
+        target = match_click.group(1).strip()
+        # The index harvest for local ranking starts while the direct lookups run
+        harvest = yield spawn(harvest_clickables(page))
+        # Try robust Playwright selectors first, then Playwright's text selector
+        found = yield first_of(
+            shown_as("role", page.get_by_role("button", name=target)),
+            shown_as("label", page.get_by_label(target)),
+            shown_as("test id", page.get_by_test_id(target)),
+            shown_as("text", page.locator(f'text="{target}"').first),
+        )
+        if found:
+            how, elem = found
+            try:
+                yield from click_element(elem)
+                harvest.cancel()
+                print(f"Clicked '{target}' using {how} selector.")
                 speak(f"Clicked {target}.")
                 return
-            else:
-                print("Element found but not visible.")
-        except Exception:
-            print("Text selector did not work, trying AI fallback...")
-        html = page.content()
+            except Exception:
+                pass
+        print("Text selector did not work, trying local ranking...")
+        # Rank harvested element texts locally; only ask the LLM when the match is ambiguous
+        clickable = [(i, text, elem) for i, (text, elem) in enumerate((yield harvest))]
+        check_cancelled()
+        scores = score_click_targets(target, [text for _, text, _ in clickable])
+        ranked = confident_target(scores)
+        if ranked is not None:
+            idx, score = ranked
+            elem = clickable[idx][2]
+            yield from click_element(elem)
+            print(f"Clicked '{clickable[idx][1]}' using local ranking (score {score:.2f}).")
+            speak(f"Clicked {target}.")
+            return
+        # Several equally good matches: the user knows which one they meant
+        close = close_targets(scores)
+        if len(close) > 1 and can_ask():
+            choice = yield from ask_which([clickable[i][1] for i in close])
+            if choice is not None:
+                idx = close[choice]
+                yield from click_element(clickable[idx][2])
+                print(f"Clicked '{clickable[idx][1]}' chosen by the user.")
+                speak(f"Clicked {clickable[idx][1]}.")
+            return
+        print("No confident local match, trying AI fallback...")
+        html = yield from prompt_html(page)
         prompt = (
-            f"Given the following HTML, what is the best Playwright-compatible CSS selector or text selector to find and click a clickable element (like a link or button) whose visible text contains or is similar to '{target}'? "
-            f"Do NOT use :contains(). If the element is best found by visible text, respond with Playwright's text selector syntax, e.g., text=\"{target}\". "
-            f"Respond with only the selector string.\nHTML:\n" + html[:3000]
+            f"Given the following HTML, what are the best Playwright-compatible CSS selectors or text selectors to find and click a clickable element (like a link or button) whose visible text contains or is similar to '{target}'? "
+            f"Do NOT use :contains(). If the element is best found by visible text, use Playwright's text selector syntax, e.g., text=\"{target}\". "
+            + selector_list_instructions(["#login", f'text="{target}"']) + "\nHTML:\n" + html[:3000]
         )
         try:
-            response = client.chat.completions.create(
-                model=MODEL,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0,
-                max_tokens=100,
-            )
-            print(f"AI raw response: {response}")  # Debug: show full response
-            ai_content = response.choices[0].message.content.strip()
-            selector = extract_selector(ai_content)
-            print(f"AI suggested selector: {selector}")
-            # If selector looks like a text selector, use Playwright's text selector API
-            selector = selector.strip().strip("'").strip('"')
-            if selector.startswith('text=') or selector.startswith('text:"') or selector.startswith('text\"') or selector.startswith('text\'='):
-                try:
-                    elem = page.locator(selector).first
-                    if elem and elem.is_visible():
-                        try:
-                            elem.scroll_into_view_if_needed()
-                        except Exception:
-                            pass
-                        elem.click()
-                        print(f"Clicked '{target}' using AI text selector.")
-                        speak(f"Clicked {target}.")
-                        return
-                except Exception as e:
-                    print(f"AI text selector error: {e}")
-            else:
-                # Try as CSS selector
-                try:
-                    elem = page.wait_for_selector(selector, timeout=5000)
-                    if elem and elem.is_visible():
-                        try:
-                            elem.scroll_into_view_if_needed()
-                        except Exception:
-                            pass
-                        elem.click()
-                        print(f"Clicked '{target}' using AI CSS selector.")
-                        speak(f"Clicked {target}.")
-                        return
-                except Exception as e:
-                    print(f"AI CSS selector error: {e}")
-            print("AI selector did not work, trying heuristics...")
+            ai_content = yield offload(llm.complete, prompt, route="selector")
+            candidates = selector_candidates(ai_content)
+            print(f"AI suggested selectors: {candidates}")
+            best = yield from best_ai_selector(page, candidates, target, "click")
+            if best:
+                yield from click_element(best[1])
+                print(f"Clicked '{target}' using AI selector {best[0]}.")
+                speak(f"Clicked {target}.")
+                return
+            print("AI selectors did not work, trying heuristics...")
         except Exception as e:
             print(f"AI error: {e}")
             print("Trying heuristics...")
-        # Heuristic fallback for clickable elements
-        selectors = [
-            'a', 'button', '[role=button]', '[role=link]', '[tabindex="0"]', '[onclick]', '[data-testid]', '[aria-label]'
-        ]
-        clickable = []
-        for sel in selectors:
-            for elem in page.query_selector_all(sel):
-                if elem.is_visible():
-                    text = None
-                    try:
-                        text = elem.inner_text().strip()
-                    except Exception:
-                        pass
-                    if not text:
-                        try:
-                            text = elem.get_attribute('aria-label') or elem.get_attribute('title') or elem.get_attribute('name') or elem.get_attribute('id')
-                        except Exception:
-                            text = None
-                    if text:
-                        clickable.append((text, elem))
-        # Remove duplicates by text
-        seen = set()
-        unique_clickable = []
-        for text, elem in clickable:
-            if text not in seen:
-                unique_clickable.append((text, elem))
-                seen.add(text)
-        clickable = [(i, text, elem) for i, (text, elem) in enumerate(unique_clickable)]
+        # Heuristic fallback for clickable elements (harvested above)
         # Try ordinal
         idx = extract_ordinal(target)
         if idx is not None and idx < len(clickable):
-            clickable[idx][2].click()
+            yield from click_element(clickable[idx][2])
             print(f"Clicked item: {clickable[idx][1]}")
             speak(f"Clicked item {clickable[idx][1]}")
             return
         # Try fuzzy match
-        idx, elem = fuzzy_match_title(target, clickable)
+        idx, elem = yield from choose_title(target, clickable)
         if elem:
-            elem.click()
+            yield from click_element(elem)
             print(f"Clicked item: {clickable[idx][1]}")
             speak(f"Clicked item {clickable[idx][1]}")
             return
         print("Could not find clickable element by heuristics.")
         speak("Could not find clickable element by heuristics.")
-        suggest_clickable_elements(page)
+        yield from suggest_clickable_elements(page)
         return
 
     # Play command: "play <something>"
@@ -809,32 +3184,24 @@ def handle_command(page, command):
         target = match.group(1)
         print(f"Trying to play '{target}' (AI fallback)...")
         speak(f"Trying to play {target} using AI.")
-        html = page.content()
+        html = yield from prompt_html(page)
         prompt = (
-            f"Given the following HTML, what is the best CSS selector to find and click the element to play '{target}'? "
+            f"Given the following HTML, what are the best CSS selectors to find and click the element to play '{target}'? "
             f"If on YouTube, this should be the first video or the video matching '{target}'. "
-            f"Respond with only the selector string.\nHTML:\n" + html[:3000]
+            + selector_list_instructions(["a#video-title", "button.play"]) + "\nHTML:\n" + html[:3000]
         )
         try:
-            response = client.chat.completions.create(
-                model=MODEL,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0,
-                max_tokens=100,
-            )
-            print(f"AI raw response: {response}")  # Debug: show full response
-            ai_content = response.choices[0].message.content.strip()
-            selector = extract_selector(ai_content)
-            print(f"AI suggested selector: {selector}")
-            try:
-                elem = page.wait_for_selector(selector, timeout=5000)
-                elem.click()
+            ai_content = yield offload(llm.complete, prompt, route="selector")
+            candidates = selector_candidates(ai_content)
+            print(f"AI suggested selectors: {candidates}")
+            best = yield from best_ai_selector(page, candidates, target, "click")
+            if best:
+                yield from click_element(best[1])
                 print(f"Played '{target}'.")
                 speak(f"Played {target}.")
                 return
-            except PlaywrightTimeoutError:
-                print("Element not found or not clickable after waiting.")
-                speak("Element not found or not clickable after waiting.")
+            print("Element not found or not clickable.")
+            speak("Element not found or not clickable.")
         except Exception as e:
             print(f"AI error: {e}")
             speak("AI could not help with playing.")
@@ -843,7 +3210,7 @@ def handle_command(page, command):
     # Scroll up/down commands
     if command.strip().lower() == "scroll up":
         try:
-            page.evaluate("() => window.scrollBy(0, -500)")
+            yield page.evaluate("() => window.scrollBy(0, -500)")
             print("Scrolled up.")
             speak("Scrolled up.")
         except Exception as e:
@@ -852,7 +3219,7 @@ def handle_command(page, command):
         return
     if command.strip().lower() == "scroll down":
         try:
-            page.evaluate("() => window.scrollBy(0, 500)")
+            yield page.evaluate("() => window.scrollBy(0, 500)")
             print("Scrolled down.")
             speak("Scrolled down.")
         except Exception as e:
@@ -860,52 +3227,14 @@ def handle_command(page, command):
             speak("Could not scroll down.")
         return
 
-    # Universal click item by ordinal or fuzzy title: 'click item <target>'
-    match_item = re.match(r"click item (.+)", command, re.IGNORECASE)
-    if match_item:
-        user_input = match_item.group(1).strip()
-        # Try to find clickable items: links, buttons, cards, etc.
-        selectors = [
-            'a', 'button', '[role=button]', '[role=link]', '[tabindex="0"]', '[onclick]', '[data-testid]', '[aria-label]'
-        ]
-        clickable = []
-        for sel in selectors:
-            for elem in page.query_selector_all(sel):
-                if elem.is_visible():
-                    # Try to get the most descriptive text
-                    text = elem.inner_text().strip()
-                    if not text:
-                        text = elem.get_attribute('aria-label') or elem.get_attribute('title') or ''
-                    if text:
-                        clickable.append((text, elem))
-        # Remove duplicates by text
-        seen = set()
-        unique_clickable = []
-        for text, elem in clickable:
-            if text not in seen:
-                unique_clickable.append((text, elem))
-                seen.add(text)
-        clickable = [(i, text, elem) for i, (text, elem) in enumerate(unique_clickable)]
-        # Try ordinal
-        idx = extract_ordinal(user_input)
-        if idx is not None and idx < len(clickable):
-            clickable[idx][2].click()
-            print(f"Clicked item: {clickable[idx][1]}")
-            speak(f"Clicked item {clickable[idx][1]}")
-            return
-        # Try fuzzy match
-        idx, elem = fuzzy_match_title(user_input, clickable)
-        if elem:
-            elem.click()
-            print(f"Clicked item: {clickable[idx][1]}")
-            speak(f"Clicked item {clickable[idx][1]}")
-            return
-        # Fallback: list titles
-        print("Could not find a matching item. Here are the top results:")
-        speak("I couldn't find a matching item. Here are the top results.")
-        for i, text, _ in clickable[:5]:
-            print(f"{i+1}: {text}")
-            speak(f"Result {i+1}: {text}")
+    # Extract command: "extract <target>" or "extract <target> as csv"
+    match = re.match(r"extract (.+?)(?:\s+(?:as|to)\s+(csv|jsonl|json))?$", command.strip(), re.IGNORECASE)
+    if match:
+        target = match.group(1).strip()
+        fmt = match.group(2).lower() if match.group(2) else None
+        if fmt == "json":
+            fmt = "jsonl"
+        yield from extract_info(page, target, fmt=fmt)
         return
 
     print("Command not recognized or not supported.")
@@ -916,9 +3245,9 @@ def suggest_clickable_elements(page, clickable=None):
         if clickable is None:
             clickable = []
             for sel in ['button', 'a']:
-                for elem in page.query_selector_all(sel):
-                    if elem.is_visible():
-                        text = elem.inner_text().strip()
+                for elem in handles.track_all((yield page.query_selector_all(sel))):
+                    if (yield elem.is_visible()):
+                        text = (yield elem.inner_text()).strip()
                         if text:
                             clickable.append((text, elem))
         suggestions = [t for t, _ in clickable]
@@ -926,7 +3255,10 @@ def suggest_clickable_elements(page, clickable=None):
             print("Some clickable elements you can try (use 'click #<number>'):")
             for i, s in enumerate(suggestions[:10]):
                 print(f"#{i}: {s}")
-            page._clickable_suggestions = [elem for _, elem in clickable[:10]]
+            locators = []
+            for _, elem in clickable[:10]:
+                locators.append((yield from as_locator(elem)))
+            page._clickable_suggestions = locators
             speak("Some clickable elements are suggested in the console.")
         else:
             print("No visible clickable elements found.")
@@ -934,9 +3266,9 @@ def suggest_clickable_elements(page, clickable=None):
     except Exception as e:
         print(f"Error suggesting clickable elements: {e}")
         speak("Could not suggest clickable elements.")
-        save_debug_info(page, "suggest_clickable_elements")
+        yield from save_debug_info(page, "suggest_clickable_elements")
 
-def listen_for_command(recognizer, microphone, overlay, prompt=None):
+def listen_for_command(recognizer, microphone, overlay, prompt=None, timeout=None):
     """Listen for a voice command and return the recognized text."""
     if prompt:
         print(prompt)
@@ -944,7 +3276,11 @@ def listen_for_command(recognizer, microphone, overlay, prompt=None):
     with microphone as source:
         print("🎤 Listening for your command...")
         recognizer.adjust_for_ambient_noise(source)
-        audio = recognizer.listen(source)
+        try:
+            audio = recognizer.listen(source, timeout=timeout)
+        except sr.WaitTimeoutError:
+            overlay.set_status("Ready")
+            return None
     overlay.set_status("Processing...")
     try:
         command = recognizer.recognize_google(audio)
@@ -962,71 +3298,415 @@ def listen_for_command(recognizer, microphone, overlay, prompt=None):
         overlay.set_status("Ready")
         return None
 
-def click_best_match(page, target):
-    global last_search_results
-    # Try to find all clickable items (e.g., video titles, product names)
-    selectors = [
-        'a', 'button', '[role=button]', '[role=link]', '[tabindex="0"]', '[onclick]', '[data-testid]', '[aria-label]'
-    ]
-    clickable = []
-    for sel in selectors:
-        for elem in page.query_selector_all(sel):
-            if elem.is_visible():
-                text = None
-                try:
-                    text = elem.inner_text().strip()
-                except Exception:
-                    pass
-                if not text:
-                    try:
-                        text = elem.get_attribute('aria-label') or elem.get_attribute('title') or elem.get_attribute('name') or elem.get_attribute('id')
-                    except Exception:
-                        text = None
-                if text:
-                    clickable.append((text, elem))
-    last_search_results = clickable
-    # Fuzzy match
-    texts = [t for t, _ in clickable]
-    matches = get_close_matches(target, texts, n=3, cutoff=0.5)
-    if not matches:
-        print("No matching result found.")
-        speak("No matching result found.")
-        return False
-    if len(matches) == 1:
-        idx = texts.index(matches[0])
-        elem = clickable[idx][1]
-        elem.click()
-        print(f"Clicked item: {matches[0]}")
-        speak(f"Clicked item: {matches[0]}")
-        return True
-    # Multiple matches: ask user to pick
+class VoiceInput:
+    """Microphone front end for the bot loop. In continuous mode utterances are
+    recognized in the background and queued; "stop"/"cancel" while a command runs
+    cancels its deadline, and ask() hands the next utterance to a waiting prompt."""
+
+    def __init__(self, recognizer, microphone, overlay, continuous=True):
+        self.recognizer = recognizer
+        self.microphone = microphone
+        self.overlay = overlay
+        self.continuous = continuous
+        self.commands = queue.Queue()
+        self.answers = queue.Queue()
+        self.awaiting_answer = threading.Event()
+        self.busy = threading.Event()
+        self.worker = None
+        self._stop_listening = None
+
+    def start(self):
+        self.worker = threading.get_ident()
+        if not self.continuous:
+            return
+        with self.microphone as source:
+            self.recognizer.adjust_for_ambient_noise(source)
+        self._stop_listening = self.recognizer.listen_in_background(
+            self.microphone, self._heard, phrase_time_limit=LISTEN_PHRASE_LIMIT)
+        self.overlay.set_status("Listening...")
+        print("🎤 Listening continuously...")
+
+    def stop(self):
+        if self._stop_listening is not None:
+            self._stop_listening(wait_for_stop=False)
+
+    def _heard(self, recognizer, audio):
+        # The phrase just ended; drop it if the bot was talking at any point while it was captured
+        heard_at = time.monotonic()
+        duration = len(audio.frame_data) / float(audio.sample_rate * audio.sample_width)
+        if speech_window.overlaps(heard_at - duration, heard_at):
+            return
+        try:
+            text = recognizer.recognize_google(audio)
+        except sr.UnknownValueError:
+            return
+        except sr.RequestError as e:
+            print(f"❌ Could not request results from Google Speech Recognition service; {e}")
+            return
+        print(f"🗣️ You said: {text}")
+        if self.awaiting_answer.is_set():
+            self.answers.put(text)
+            return
+        if self.busy.is_set() and text.strip().lower() in CANCEL_WORDS:
+            # Barge-in: end the running command and drop what was queued behind it
+            while not self.commands.empty():
+                self.commands.get_nowait()
+            if cancel_commands(self.worker):
+                print("Cancelling the current command.")
+            return
+        self.commands.put(text)
+
+    def next_command(self):
+        if not self.continuous:
+            return listen_for_command(self.recognizer, self.microphone, self.overlay)
+        command = self.commands.get()
+        self.overlay.set_status("Processing...")
+        return command
+
+    def ask(self, question, timeout=DISAMBIGUATION_TIMEOUT):
+        """Speak a question and return the answer, or None if nothing is said in time."""
+        if not self.continuous:
+            speak(question)
+            return listen_for_command(self.recognizer, self.microphone, self.overlay, prompt=question, timeout=timeout)
+        # Ask first: anything heard while the question plays is not the answer
+        speak(question)
+        while not self.answers.empty():
+            self.answers.get_nowait()
+        self.awaiting_answer.set()
+        try:
+            return self.answers.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        finally:
+            self.awaiting_answer.clear()
+
+# The bot loop's voice input; API sessions have none and cannot be asked anything
+voice = None
+
+def parse_choice(answer, count):
+    """'2', 'two', 'the second one', 'option 2' -> 0-based index, or None."""
+    if not answer:
+        return None
+    text = answer.strip().lower()
+    for word, number in {"one": 1, "two": 2, "three": 3, "four": 4, "five": 5}.items():
+        text = re.sub(rf"\b{word}\b", str(number), text)
+    idx = extract_ordinal(text)
+    return idx if idx is not None and 0 <= idx < count else None
+
+def can_ask():
+    """Only the voice loop's own thread may ask; API sessions have no one to answer."""
+    return voice is not None and voice.worker == threading.get_ident()
+
+def ask_which(options):
+    """Read out close matches and return the index of the one the user picks, or
+    None when no clear answer comes within DISAMBIGUATION_TIMEOUT."""
     print("Multiple matches found:")
-    for i, m in enumerate(matches):
-        print(f"{i+1}: {m}")
-        speak(f"Option {i+1}: {m}")
-    speak("Please say the number of the option you want.")
-    # Listen for user choice
-    choice = None
-    while choice is None:
-        user_input = listen_for_command(recognizer, microphone, overlay, prompt="Say the number of your choice.")
-        if user_input:
+    for i, option in enumerate(options):
+        print(f"{i+1}: {option}")
+        speak(f"Option {i+1}: {option}")
+    # One answer, bounded by a timeout, instead of listening until a number is heard
+    answer = yield offload(voice.ask, "Please say the number of the option you want.")
+    choice = parse_choice(answer, len(options))
+    if choice is None:
+        print("No option chosen.")
+        speak("No option chosen.")
+    return choice
+
+def choose_title(user_input, item_info):
+    """fuzzy_match_title, except that titles matching about as well as the best one
+    are offered to the user when they can be asked. Returns (index, item) or (None, None)."""
+    texts = [text for _, text, _ in item_info]
+    matches = get_close_matches(user_input, texts, n=3, cutoff=0.4)
+    if not matches:
+        return None, None
+    ratio = lambda text: difflib.SequenceMatcher(None, user_input, text).ratio()
+    best = ratio(matches[0])
+    close = [m for m in matches if best - ratio(m) < CLICK_RANK_MARGIN]
+    if len(close) > 1 and can_ask():
+        choice = yield from ask_which(close)
+        if choice is None:
+            return None, None
+        matches = [close[choice]]
+    for i, text, elem in item_info:
+        if text == matches[0]:
+            return i, elem
+    return None, None
+
+# Verbs a compound command may be split before: "search X and click the second result"
+COMPOUND_VERBS = r"(?:open|go to|navigate to|search|click|type|fill|play|scroll|extract|summari[sz]e)"
+_COMPOUND_SPLIT = re.compile(
+    rf"\s*(?:,|;|\band then\b|\bthen\b|\band\b|\bafter that\b)\s*(?:then\s+)?(?={COMPOUND_VERBS}\b)",
+    re.IGNORECASE,
+)
+_ORDINAL_TARGET = re.compile(
+    r"^(?:on\s+)?(?:the\s+)?((?:first|second|third|fourth|fifth|sixth|seventh|eighth|ninth|tenth)|\d+(?:st|nd|rd|th)?)"
+    r"(?:\s+(?:one|result|link|item|video|option|entry|product))?s?$",
+    re.IGNORECASE,
+)
+
+def _normalize_step(step):
+    step = step.strip().rstrip(".")
+    step = re.sub(r"^(?:go|navigate) to\s+", "open ", step, flags=re.IGNORECASE)
+    step = re.sub(r"^search for\s+", "search ", step, flags=re.IGNORECASE)
+    if re.match(r"^summari[sz]e\b", step, re.IGNORECASE):
+        return "summarize"
+    match = re.match(r"^click (?:on )?(.+)$", step, re.IGNORECASE)
+    if match:
+        ordinal = _ORDINAL_TARGET.match(match.group(1).strip())
+        # "click the second result" -> ordinal pick from the page, no selector guessing
+        return f"click item {ordinal.group(1)}" if ordinal else f"click {match.group(1).strip()}"
+    return step
+
+def parse_compound_command(command):
+    """Split "open github then search playwright" into ["open github", "search playwright"].
+    Returns None unless there are several parts and each starts with a known verb."""
+    parts = [p for p in _COMPOUND_SPLIT.split(command.strip()) if p.strip()]
+    if len(parts) < 2 or not all(re.match(rf"{COMPOUND_VERBS}\b", p.strip(), re.IGNORECASE) for p in parts):
+        return None
+    return [_normalize_step(p) for p in parts]
+
+def _wait_for_step(page, before_url):
+    """After a step that may navigate, wait for the new page instead of a fixed sleep."""
+    limit = time.monotonic() + min(4, current_deadline().remaining())
+    while time.monotonic() < limit:
+        if page.url != before_url:
             try:
-                num = int(user_input.strip())
-                if 1 <= num <= len(matches):
-                    choice = num
+                yield page.wait_for_load_state("domcontentloaded", timeout=stage_timeout(10000))
             except Exception:
-                continue
-    idx = texts.index(matches[choice-1])
-    elem = clickable[idx][1]
-    elem.click()
-    print(f"Clicked item: {matches[choice-1]}")
-    speak(f"Clicked item: {matches[choice-1]}")
-    return True
+                pass
+            return
+        yield page.wait_for_timeout(200)
+
+def run_local_plan(page, steps):
+    for i, step in enumerate(steps):
+        if deadline_expired():
+            print("Command budget used up, skipping remaining steps.")
+            break
+        last_action = session_state.last_action = step.split()[0]
+        before_url = page.url
+        try:
+            if step == "summarize":
+                yield from summarize_page(page)
+            else:
+                yield from run_command(page, step)
+        except Exception as e:
+            print(f"[Plan] Step '{step}' failed: {e}")
+            break
+        if i < len(steps) - 1 and last_action in ("open", "search", "click"):
+            yield from _wait_for_step(page, before_url)
+
+class StackSampler:
+    """Samples one thread's Python stack on a timer. Stacks are counted in collapsed
+    form ("outer;inner;leaf"), which flame graph tools read directly."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+class CommandProfiler:
+    """Collects per-command profiles and merges them into one session report."""
+
+    def __init__(self, mode, directory):
+        self.mode = mode
+        self.directory = directory
+        self.stats = None
+        self.samples = collections.Counter()
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def _base_path(self, command):
+        with self.lock:
+            self.count += 1
+            n = self.count
+        os.makedirs(self.directory, exist_ok=True)
+        slug = re.sub(r"\W+", "_", command.lower()).strip("_")[:40] or "command"
+        return os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}_{n:04d}_{slug}")
+
+    def add_profile(self, prof, command):
+        prof.dump_stats(self._base_path(command) + ".prof")
+        with self.lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(prof, stream=io.StringIO())
+            else:
+                self.stats.add(prof)
+
+    def add_samples(self, stacks, command):
+        with open(self._base_path(command) + ".folded", "w", encoding="utf-8") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        with self.lock:
+            self.samples.update(stacks)
+
+    def report(self, top=PROFILE_TOP):
+        """Hot functions across every profiled command so far, as text."""
+        with self.lock:
+            out = io.StringIO()
+            if self.stats is not None:
+                self.stats.stream = out
+                self.stats.sort_stats("cumulative").print_stats(top)
+                self.stats.sort_stats("tottime").print_stats(top)
+            if self.samples:
+                out.write(format_samples(self.samples, top))
+        return out.getvalue()
+
+    def write_report(self):
+        text = self.report()
+        if not text:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"report_{time.strftime('%Y%m%d-%H%M%S')}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return path
+
+def format_samples(stacks, top=PROFILE_TOP):
+    total = sum(stacks.values())
+    own = collections.Counter()
+    cumulative = collections.Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(";")
+        own[frames[-1]] += count
+        for name in set(frames):
+            cumulative[name] += count
+    lines = [f"{total} samples"]
+    for title, counter in (("self", own), ("cumulative", cumulative)):
+        lines.append(f"\nTop functions by {title} samples:")
+        for name, count in counter.most_common(top):
+            lines.append(f"{100.0 * count / total:6.1f}%  {count:7d}  {name}")
+    return "\n".join(lines) + "\n"
+
+def aggregate_profiles(directory=PROFILE_DIR, top=PROFILE_TOP):
+    """Merge every .prof and .folded file in a directory, e.g. after a batch run."""
+    agg = CommandProfiler("off", directory)
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name.endswith(".prof"):
+            if agg.stats is None:
+                agg.stats = pstats.Stats(path, stream=io.StringIO())
+            else:
+                agg.stats.add(path)
+        elif name.endswith(".folded"):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    stack, _, count = line.rstrip("\n").rpartition(" ")
+                    if stack:
+                        agg.samples[stack] += int(count)
+    return agg.report(top)
+
+profiler = CommandProfiler(PROFILE_MODE, PROFILE_DIR)
+
+class profiled_command:
+    """Context manager that profiles one command with the configured PROFILE_MODE.
+    cProfile allows one active profiler per process on newer Pythons, so a command
+    that overlaps another profiled one is sampled instead."""
+
+    def __init__(self, command):
+        self.command = command
+        self.prof = None
+        self.sampler = None
+
+    def __enter__(self):
+        if profiler.mode == "cprofile":
+            self.prof = cProfile.Profile()
+            try:
+                self.prof.enable()
+            except ValueError:
+                self.prof = None
+        if profiler.mode in ("cprofile", "sample") and self.prof is None:
+            self.sampler = StackSampler(threading.get_ident(), PROFILE_INTERVAL_MS / 1000.0)
+            self.sampler.start()
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            if self.prof is not None:
+                self.prof.disable()
+                profiler.add_profile(self.prof, self.command)
+            elif self.sampler is not None:
+                self.sampler.stop()
+                profiler.add_samples(self.sampler.stacks, self.command)
+        except Exception as e:
+            print(f"[Profile] Could not save profile: {e}")
+        return False
+
+def _outer_budget(user_command):
+    """Root budget of a spoken command. Nested budgets are capped by it, so a single
+    command gets at least its own type's budget ("extract", "run" outlast "plan");
+    the planner's budget covers local plans and the AI fallback."""
+    if parse_compound_command(user_command):
+        return COMMAND_BUDGETS["plan"]
+    tokens = user_command.lower().split()
+    own = COMMAND_BUDGETS.get(tokens[0], COMMAND_BUDGETS["default"]) if tokens else COMMAND_BUDGETS["default"]
+    return max(own, COMMAND_BUDGETS["plan"])
+
+def run_ai_command(user_command, page, overlay):
+    # One root deadline per spoken command, so a cancel reaches every stage of it
+    try:
+        with profiled_command(user_command), command_deadline("plan", _outer_budget(user_command)):
+            yield from _run_ai_command(user_command, page, overlay)
+    except CommandCancelled:
+        print("[Cancel] Command cancelled.")
+        overlay.set_status("Ready")
 
 def ai_command_handler(user_command, page, overlay):
-    global last_action
+    return run_sync(run_ai_command(user_command, page, overlay))
+
+def _run_ai_command(user_command, page, overlay):
     overlay.set_status("Processing...")
-    html = page.content()
+    # Common compound shapes are split locally; only other phrasings reach the planner
+    steps = parse_compound_command(user_command)
+    if steps:
+        print(f"[Plan] Local plan: {steps}")
+        yield from run_local_plan(page, steps)
+        overlay.set_status("Ready")
+        return
+    try:
+        # Always try heuristics first
+        try:
+            yield from run_command(page, user_command)
+            overlay.set_status("Ready")
+            return
+        except SecretUnavailable as e:
+            # The AI plan would ask for the same secret again
+            print(f"[Secrets] {e}")
+            speak("That needs a secret that was not supplied.")
+            overlay.set_status("Ready")
+            return
+        except Exception as heur_e:
+            print(f"[Heuristics failed, falling back to AI] {heur_e}")
+        # If heuristics fail, use AI plan, within the planner's budget
+        with command_deadline("plan"):
+            yield from _run_ai_plan(user_command, page)
+        overlay.set_status("Ready")
+    except Exception as e:
+        print(f"[AI Command Handler Error] {e}")
+        overlay.set_status("Ready")
+
+def _run_ai_plan(user_command, page):
+    """Ask the model to break the command into steps and run them."""
+    html = yield from prompt_html(page)
+    last_action = session_state.last_action
     context = f"Last action: {last_action}. " if last_action else ""
     prompt = (
         f"You are an AI web automation assistant. {context}Given the following user command and the current page HTML, "
@@ -1037,82 +3717,57 @@ def ai_command_handler(user_command, page, overlay):
         f"User command: {user_command}\n"
         f"HTML:\n{html[:3000]}"
     )
+    ai_content = yield offload(llm.complete, prompt, route="plan")
     try:
-        import json
-        # Always try heuristics first
-        try:
-            handle_command(page, user_command)
-            overlay.set_status("Ready")
+        plan = json.loads(ai_content)
+    except Exception:
+        match = re.search(r'\[.*\]', ai_content, re.DOTALL)
+        if match:
+            plan = json.loads(match.group(0))
+        else:
+            print("AI could not parse plan, giving up.")
             return
-        except Exception as heur_e:
-            print(f"[Heuristics failed, falling back to AI] {heur_e}")
-        # If heuristics fail, use AI plan
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0,
-            max_tokens=300,
-        )
-        ai_content = response.choices[0].message.content.strip()
+    if user_command.strip().lower().startswith('click'):
+        filtered_plan = [step for step in plan if step.get('action', '').lower() != 'search']
+        if not filtered_plan:
+            filtered_plan = [{'action': 'click', 'target': user_command.strip()[6:]}]
+        plan = filtered_plan
+    for i, step in enumerate(plan):
+        action = step.get('action', '').lower()
+        target = step.get('target', '')
+        session_state.last_action = action
+        performed = False
         try:
-            plan = json.loads(ai_content)
-        except Exception:
-            import re
-            match = re.search(r'\[.*\]', ai_content, re.DOTALL)
-            if match:
-                plan = json.loads(match.group(0))
+            if action in ['open', 'search', 'click', 'type']:
+                yield from run_command(page, f"{action} {target}")
+                performed = True
+            elif action == 'summarize':
+                yield from summarize_page(page, speak_result=False)  # Do not speak
+                performed = True
+            elif action == 'extract':
+                yield from extract_info(page, target, speak_result=False)  # Do not speak
+                performed = True
             else:
-                print("AI could not parse plan, giving up.")
-                overlay.set_status("Ready")
-                return
-        if user_command.strip().lower().startswith('click'):
-            filtered_plan = [step for step in plan if step.get('action', '').lower() != 'search']
-            if not filtered_plan:
-                filtered_plan = [{'action': 'click', 'target': user_command.strip()[6:]}]
-            plan = filtered_plan
-        for i, step in enumerate(plan):
-            action = step.get('action', '').lower()
-            target = step.get('target', '')
-            last_action = action
-            performed = False
-            try:
-                if action in ['open', 'search', 'click', 'type']:
-                    handle_command(page, f"{action} {target}")
-                    performed = True
-                elif action == 'summarize':
-                    summarize_page(page, speak_result=False)  # Do not speak
-                    performed = True
-                elif action == 'extract':
-                    extract_info(page, target, speak_result=False)  # Do not speak
-                    performed = True
-                else:
-                    print(f"Unknown action: {action}, skipping.")
-                    performed = False
-            except Exception as e:
-                print(f"[AI fallback failed for {action}] {e}")
+                print(f"Unknown action: {action}, skipping.")
                 performed = False
-            if len(plan) > 1 and i < len(plan) - 1:
-                time.sleep(4)
-        overlay.set_status("Ready")
-    except Exception as e:
-        print(f"[AI Command Handler Error] {e}")
-        overlay.set_status("Ready")
+        except Exception as e:
+            print(f"[AI fallback failed for {action}] {e}")
+            performed = False
+        if len(plan) > 1 and i < len(plan) - 1:
+            if deadline_expired():
+                print("Command budget used up, skipping remaining steps.")
+                break
+            yield pause(min(4, current_deadline().remaining()))
 
 # Update summarize_page and extract_info to only speak concise results
 
 def summarize_page(page, speak_result=True):
-    html = page.content()
+    html = yield page.content()
     prompt = (
         f"Summarize the main content of this web page in 2-3 sentences.\nHTML:\n{html[:3000]}"
     )
     try:
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0,
-            max_tokens=150,
-        )
-        summary = response.choices[0].message.content.strip()
+        summary = yield offload(llm.complete, prompt, route="summarize")
         print(f"Summary: {summary}")
         if speak_result:
             speak(summary)
@@ -1121,19 +3776,37 @@ def summarize_page(page, speak_result=True):
         if speak_result:
             speak("I could not summarize this page.")
 
-def extract_info(page, target, speak_result=True):
-    html = page.content()
+def write_captured(records, target, fmt=None):
+    fmt = (fmt or EXTRACT_FORMAT).lower()
+    if fmt not in ("jsonl", "csv"):
+        fmt = "jsonl"
+    path = extract_path(target, fmt)
+    writer = RowWriter(path, fmt)
+    try:
+        for record in records:
+            writer.write(record)
+    finally:
+        writer.close()
+    return writer.count, path
+
+def extract_info(page, target, speak_result=True, fmt=None):
+    # Captured JSON results, then tables and repeated cards; the LLM is only the fallback
+    records = captured_results(page) if not target or RESULT_TARGET_WORDS.search(target) else []
+    if records:
+        count, path = write_captured(records, target, fmt)
+    else:
+        count, path = yield from extract_structured(page, target, fmt=fmt)
+    if count:
+        print(f"Extracted {count} rows about '{target}' to {path}")
+        if speak_result:
+            speak(f"Extracted {count} rows about {target}.")
+        return
+    html = yield page.content()
     prompt = (
         f"Extract all information about '{target}' from this web page. List any relevant data, links, or facts.\nHTML:\n{html[:3000]}"
     )
     try:
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0,
-            max_tokens=200,
-        )
-        info = response.choices[0].message.content.strip()
+        info = yield offload(llm.complete, prompt, route="extract")
         print(f"Extracted info: {info}")
         if speak_result:
             speak(info)
@@ -1143,26 +3816,336 @@ def extract_info(page, target, speak_result=True):
             speak(f"I could not extract information about {target}.")
 
 def bot_main(overlay):
+    global voice
     p, browser, page = setup_playwright()
+    voice = VoiceInput(recognizer, microphone, overlay, continuous=LISTEN_MODE == "continuous")
     try:
         speak("Voice recognition is now active. Please speak your command.")
+        voice.start()
         while True:
-            command = listen_for_command(recognizer, microphone, overlay)
+            command = voice.next_command()
             if not command:
                 continue
-            if command.strip().lower() in ["exit", "quit", "stop", "bye"]:
+            if command.strip().lower() in EXIT_WORDS:
                 print("Exiting.")
                 speak("Exiting.")
                 break
-            ai_command_handler(command, page, overlay)
-            time.sleep(2)  # Small delay to avoid rapid repeated listening
+            if command.strip().lower() in CANCEL_WORDS:
+                continue
+            browser, page = ensure_browser(p, browser, page)
+            voice.busy.set()
+            try:
+                ai_command_handler(command, page, overlay)
+            finally:
+                voice.busy.clear()
+            if voice.continuous:
+                overlay.set_status("Listening...")
+            else:
+                time.sleep(2)  # Small delay to avoid rapid repeated listening
     finally:
+        voice.stop()
+        for route, stats in llm.report().items():
+            print(f"[LLM] {route}: {stats}")
+        report = profiler.write_report()
+        if report:
+            print(f"[Profile] Hot-function report written to {report}")
+        try:
+            path = run_sync(stop_trace(page))
+            if path:
+                print(f"[DEBUG] Trace saved to {path}")
+        except Exception as e:
+            print(f"[DEBUG] Could not save trace: {e}")
+        # For a shared browser this only closes our context and disconnects
         browser.close()
         p.stop()
 
+class ControlSession:
+    """One API client: its own browser context driven by a worker thread, a bounded
+    command queue (a full queue is answered with 429) and events fanned out to
+    every SSE subscriber. Also stands in for the overlay of its commands."""
+
+    def __init__(self, session_id, trace=DEBUG_TRACE):
+        self.id = session_id
+        self.trace = trace
+        self.commands = queue.Queue(maxsize=CONTROL_QUEUE_SIZE)
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.status = "Starting"
+        self.current = None
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=self._run, name=f"session-{session_id}", daemon=True)
+        self.thread.start()
+
+    def set_status(self, status):
+        self.status = status
+        self.publish("status", {"status": status})
+
+    def publish(self, kind, data=None):
+        with self.lock:
+            self.seq += 1
+            event = {"seq": self.seq, "session": self.id, "type": kind, "command_id": self.current, **(data or {})}
+            for sub in self.subscribers:
+                try:
+                    sub.put_nowait(event)
+                except queue.Full:
+                    # A slow reader loses events instead of stalling the worker
+                    pass
+
+    def subscribe(self):
+        sub = queue.Queue(maxsize=CONTROL_EVENT_BUFFER)
+        with self.lock:
+            self.subscribers.append(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self.lock:
+            if sub in self.subscribers:
+                self.subscribers.remove(sub)
+
+    def submit(self, command, secrets=None):
+        """Queue a command; raises queue.Full when the session is saturated. Secrets
+        are kept with the queued command only and never published."""
+        command_id = uuid.uuid4().hex[:12]
+        self.commands.put_nowait((command_id, command, secrets or {}))
+        self.publish("queued", {"command_id": command_id, "command": command, "depth": self.commands.qsize()})
+        return command_id
+
+    def close(self):
+        self.closed.set()
+
+    def _run(self):
+        _speech_sink.emit = lambda text, cache=True: self.publish("said", {"text": text})
+        # No terminal to prompt on: secrets come with each command
+        session_state.interactive = False
+        p = sync_playwright().start()
+        browser = None
+        try:
+            browser, page = open_browser(p)
+            if self.trace:
+                run_sync(start_trace(page))
+            self.set_status("Ready")
+            while not self.closed.is_set():
+                try:
+                    command_id, command, secrets = self.commands.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                self.current = command_id
+                session_state.secrets = secrets
+                self.publish("started", {"command": command})
+                started = time.monotonic()
+                try:
+                    browser, page = ensure_browser(p, browser, page)
+                    ai_command_handler(command, page, self)
+                    self.publish("done", {"elapsed_ms": round((time.monotonic() - started) * 1000), "url": page.url})
+                except Exception as e:
+                    self.publish("error", {"error": str(e)})
+                finally:
+                    session_state.secrets = {}
+                self.current = None
+        except Exception as e:
+            self.publish("error", {"error": f"Session failed: {e}"})
+        finally:
+            self.closed.set()
+            try:
+                if browser is not None:
+                    path = run_sync(stop_trace(page))
+                    if path:
+                        self.publish("trace", {"path": path})
+                    browser.close()
+                p.stop()
+            except Exception:
+                pass
+            self.publish("closed")
+
+control_sessions = {}
+_control_lock = threading.Lock()
+
+def _prune_sessions():
+    """Forget sessions whose worker has finished (closed or failed to start).
+    Callers hold _control_lock."""
+    for sid in [sid for sid, s in control_sessions.items() if s.closed.is_set() and not s.thread.is_alive()]:
+        del control_sessions[sid]
+
+def create_control_app():
+    app = Flask(__name__)
+
+    @app.before_request
+    def check_token():
+        if CONTROL_API_TOKEN and request.headers.get("Authorization") != f"Bearer {CONTROL_API_TOKEN}":
+            return jsonify(error="unauthorized"), 401
+
+    def get_session(session_id):
+        session = control_sessions.get(session_id)
+        if session is None or session.closed.is_set():
+            return None
+        return session
+
+    @app.post("/sessions")
+    def open_session():
+        with _control_lock:
+            _prune_sessions()
+            live = [sid for sid, s in control_sessions.items() if not s.closed.is_set()]
+            if len(live) >= CONTROL_MAX_SESSIONS:
+                return jsonify(error="too many sessions", limit=CONTROL_MAX_SESSIONS), 429
+            session_id = uuid.uuid4().hex[:8]
+            trace = (request.get_json(silent=True) or {}).get("trace", DEBUG_TRACE)
+            control_sessions[session_id] = ControlSession(session_id, trace=bool(trace))
+        return jsonify(session=session_id), 201
+
+    @app.post("/sessions/<session_id>/commands")
+    def post_command(session_id):
+        session = get_session(session_id)
+        if session is None:
+            return jsonify(error="no such session"), 404
+        body = request.get_json(silent=True) or {}
+        command = (body.get("command") or "").strip()
+        if not command:
+            return jsonify(error="missing command"), 400
+        secrets = {str(k).strip().lower(): str(v) for k, v in (body.get("secrets") or {}).items()}
+        missing = [key for key in secrets_needed(command) if key not in secrets]
+        if missing:
+            return jsonify(error="missing secrets", secrets=missing), 400
+        try:
+            command_id = session.submit(command, secrets)
+        except queue.Full:
+            return jsonify(error="queue full", depth=session.commands.qsize()), 429, {"Retry-After": "1"}
+        return jsonify(command_id=command_id, depth=session.commands.qsize()), 202
+
+    @app.get("/sessions/<session_id>/events")
+    def stream_events(session_id):
+        session = get_session(session_id)
+        if session is None:
+            return jsonify(error="no such session"), 404
+        sub = session.subscribe()
+
+        def stream():
+            try:
+                while True:
+                    try:
+                        event = sub.get(timeout=15)
+                    except queue.Empty:
+                        # Keeps proxies from timing out and notices disconnected clients
+                        yield ": keepalive\n\n"
+                        continue
+                    yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+                    if event["type"] == "closed":
+                        break
+            finally:
+                session.unsubscribe(sub)
+
+        return Response(stream(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    @app.delete("/sessions/<session_id>")
+    def close_session(session_id):
+        with _control_lock:
+            session = control_sessions.pop(session_id, None)
+        if session is None:
+            return jsonify(error="no such session"), 404
+        session.close()
+        return jsonify(closed=session_id)
+
+    @app.get("/status")
+    def status():
+        with _control_lock:
+            _prune_sessions()
+            sessions = {sid: {"status": s.status, "queued": s.commands.qsize(), "closed": s.closed.is_set()}
+                        for sid, s in control_sessions.items()}
+        return jsonify(sessions=sessions, llm=llm.report())
+
+    @app.get("/profile")
+    def profile_report():
+        return Response(profiler.report() or "Profiling is off (PROFILE_MODE).\n", mimetype="text/plain")
+
+    return app
+
+def run_control_api():
+    if Flask is None:
+        print("[API] Flask is not installed; control API disabled.")
+        return
+    port = CONTROL_API_PORT or 8765
+    print(f"[API] Control API listening on http://{CONTROL_API_HOST}:{port}")
+    create_control_app().run(host=CONTROL_API_HOST, port=port, threaded=True, use_reloader=False)
+
+# ---------------------------------------------------------------------------
+# Asyncio engine (BOT_ENGINE=async): the same command flows driven by run_async on
+# playwright.async_api, so LLM calls, frame searches, index prefetching and speech
+# overlap on one event loop. Blocking pieces (Together client, pyttsx3, microphone)
+# run in worker threads.
+# ---------------------------------------------------------------------------
+
+# Speech is queued on one worker so phrases never overlap but commands don't wait for them
+_speech_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="speech")
+
+async def async_open_browser(p):
+    return await run_async(launch_browser(p))
+
+async def async_ensure_browser(p, browser, page):
+    return await run_async(reconnect_browser(p, browser, page))
+
+async def async_ai_command_handler(user_command, page, overlay):
+    return await run_async(run_ai_command(user_command, page, overlay))
+
+async def async_bot_main(overlay):
+    global voice
+    # Everything the flows say on this thread goes to the speech worker
+    _speech_sink.emit = lambda text, cache=True: _speech_pool.submit(_say, text, cache)
+    voice = VoiceInput(recognizer, microphone, overlay, continuous=LISTEN_MODE == "continuous")
+    async with async_playwright() as p:
+        browser, page = await async_open_browser(p)
+        try:
+            speak("Voice recognition is now active. Please speak your command.")
+            await asyncio.to_thread(voice.start)
+            # Commands run on this thread, so that is the one a spoken "cancel" targets
+            voice.worker = threading.get_ident()
+            while True:
+                command = await asyncio.to_thread(voice.next_command)
+                if not command:
+                    continue
+                if command.strip().lower() in EXIT_WORDS:
+                    print("Exiting.")
+                    await asyncio.wrap_future(_speech_pool.submit(_say, "Exiting."))
+                    break
+                if command.strip().lower() in CANCEL_WORDS:
+                    continue
+                browser, page = await async_ensure_browser(p, browser, page)
+                voice.busy.set()
+                try:
+                    await async_ai_command_handler(command, page, overlay)
+                finally:
+                    voice.busy.clear()
+                if voice.continuous:
+                    overlay.set_status("Listening...")
+                else:
+                    await asyncio.sleep(2)  # Small delay to avoid rapid repeated listening
+        finally:
+            voice.stop()
+            for route, stats in llm.report().items():
+                print(f"[LLM] {route}: {stats}")
+            report = profiler.write_report()
+            if report:
+                print(f"[Profile] Hot-function report written to {report}")
+            try:
+                path = await run_async(stop_trace(page))
+                if path:
+                    print(f"[DEBUG] Trace saved to {path}")
+            except Exception as e:
+                print(f"[DEBUG] Could not save trace: {e}")
+            await browser.close()
+
 if __name__ == "__main__":
+    if CONTROL_API_ONLY:
+        run_control_api()
+        raise SystemExit
+    if CONTROL_API_PORT:
+        threading.Thread(target=run_control_api, daemon=True).start()
+    if tts_cache is not None:
+        threading.Thread(target=tts_cache.warm, args=(FIXED_PHRASES,), daemon=True).start()
     overlay = AnimatedOverlay()
-    bot_thread = threading.Thread(target=bot_main, args=(overlay,), daemon=True)
+    if BOT_ENGINE == "async":
+        bot_thread = threading.Thread(target=lambda: asyncio.run(async_bot_main(overlay)), daemon=True)
+    else:
+        bot_thread = threading.Thread(target=bot_main, args=(overlay,), daemon=True)
     bot_thread.start()
     print("Overlay started!")
     overlay.run()
\ No newline at end of file
@@ -0,0 +1,352 @@
+"""Long-session soak and load harness for the bot.
+
+Replays a synthetic command stream against local fixture sites, with a fake
+OpenAI-compatible LLM and no audio, for a fixed duration and concurrency. It
+samples bot and browser RSS, live element handles and thread count, records
+per-command latency and fails (exit code 1) on memory or handle growth or latency
+drift. Commands whose spoken outcome reports a failure count as errors, not latency.
+
+    python soak.py --duration 3600 --concurrency 4 --report soak.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import re
+import argparse
+import threading
+import statistics
+import collections
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+# ---------------------------------------------------------------------------
+# Fixture site
+# ---------------------------------------------------------------------------
+
+def _page(title, body, script=""):
+    return (f"<!doctype html><html><head><title>{title}</title></head><body>"
+            f"<nav><a href='/'>Home</a> <a href='/feed'>Feed</a> <a href='/form'>Form</a></nav>"
+            f"<h1>{title}</h1>{body}<script>{script}</script></body></html>")
+
+FEED_SCRIPT = """
+let page = 0, loading = false;
+const list = document.getElementById('feed');
+async function more() {
+    if (loading) return;
+    loading = true;
+    const data = await (await fetch('/api/items?page=' + page++)).json();
+    for (const item of data.items) {
+        const li = document.createElement('li');
+        li.innerHTML = `<a href="${item.url}">${item.title}</a>`;
+        list.appendChild(li);
+    }
+    loading = false;
+}
+window.addEventListener('scroll', () => {
+    if (window.innerHeight + window.scrollY >= document.body.scrollHeight - 200) more();
+});
+more();
+"""
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body, content_type="text/html"):
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == "/":
+            self._send(_page("Fixture shop", "<form action='/search'><input type='search' name='q' aria-label='Search'>"
+                                             "<button type='submit'>Go</button></form>"
+                                             "<button onclick=\"this.textContent='Clicked'\">Sign in</button>"))
+        elif url.path == "/search":
+            q = query.get("q", [""])[0]
+            start = int(query.get("page", ["0"])[0]) * 20
+            rows = "".join(f"<li class='result'><a href='/item/{i}'>{q} result {i}</a><span>${i}.99</span></li>"
+                           for i in range(start, start + 20))
+            self._send(_page(f"Results for {q}", f"<ul>{rows}</ul><a href='/search?q={q}&page={start // 20 + 1}'>Next</a>"))
+        elif url.path.startswith("/item/"):
+            n = url.path.rsplit("/", 1)[-1]
+            table = "".join(f"<tr><td>Spec {i}</td><td>{i * 3}</td></tr>" for i in range(10))
+            self._send(_page(f"Item {n}", f"<table><tr><th>Name</th><th>Value</th></tr>{table}</table>"))
+        elif url.path == "/feed":
+            self._send(_page("Feed", "<ul id='feed'></ul>", FEED_SCRIPT))
+        elif url.path == "/api/items":
+            page = int(query.get("page", ["0"])[0])
+            items = [{"title": f"Feed entry {i}", "url": f"/item/{i}"} for i in range(page * 15, page * 15 + 15)]
+            self._send(json.dumps({"items": items}), "application/json")
+        elif url.path == "/form":
+            self._send(_page("Form", "<form><label>Name <input name='name'></label>"
+                                     "<label>Email <input type='email' name='email'></label>"
+                                     "<label>City <input name='city'></label></form>"))
+        else:
+            self.send_error(404)
+
+
+# ---------------------------------------------------------------------------
+# Fake OpenAI-compatible LLM (TOGETHER_BASE_URL points here)
+# ---------------------------------------------------------------------------
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        prompt = body.get("messages", [{}])[-1].get("content", "")
+        if "list of steps" in prompt:
+            content = '[{"action": "click", "target": "result 1"}]'
+        elif "selector" in prompt.lower():
+            content = "a[href='/item/1']"
+        elif prompt.startswith("Summarize"):
+            content = "A fixture page used by the soak test."
+        else:
+            content = "Fixture data."
+        time.sleep(self.latency)
+        data = json.dumps({
+            "id": "soak", "object": "chat.completion", "created": int(time.time()), "model": body.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                      "total_tokens": (len(prompt) + len(content)) // 4},
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+def serve(handler):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+# ---------------------------------------------------------------------------
+# Command stream and workers
+# ---------------------------------------------------------------------------
+
+def command_stream(site):
+    """One cycle of commands; each worker replays it from a random offset."""
+    return [
+        f"open {site}/",
+        "search widgets",
+        "click item 3",
+        f"open {site}/search?q=gadgets",
+        "extract results",
+        "click item second",
+        f"open {site}/feed",
+        "click item 40",
+        "scroll down",
+        f"open {site}/form",
+        "fill form name is Soak, email is soak@example.com and city is Pune",
+        "type Tester in Name",
+        f"open {site}/",
+        "click Sign in",
+        "click Nonexistent Button",
+        f"open {site}/ then search lamps",
+        "memory report",
+    ]
+
+# Spoken outcomes that mean the command did not do what was asked
+FAILURE_SAID = re.compile(r"\b(no |not |couldn't|could not|cannot|failed|unable|error|too long|didn't)", re.IGNORECASE)
+
+class NullOverlay:
+    def set_status(self, status):
+        pass
+
+class SoakStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []  # (t, kind, seconds)
+        self.errors = collections.Counter()
+        self.samples = []
+        self.handles = {}
+
+    def record(self, kind, seconds, error=None):
+        """A successful command adds a latency sample; a failed one only an error count."""
+        with self.lock:
+            if error:
+                self.errors[f"{kind}: {error}"] += 1
+            else:
+                self.latencies.append((time.monotonic(), kind, seconds))
+
+def worker(bot, stats, site, stop_at, index):
+    from playwright.sync_api import sync_playwright
+    said = collections.deque(maxlen=50)
+    bot._speech_sink.emit = lambda text, cache=True: said.append(text)
+    commands = command_stream(site)
+    position = random.Random(index).randrange(len(commands))
+    overlay = NullOverlay()
+    p = sync_playwright().start()
+    browser, page = bot.open_browser(p)
+    try:
+        while time.monotonic() < stop_at:
+            command = commands[position % len(commands)]
+            position += 1
+            kind = command.split()[0] if not command.startswith("click item") else "click item"
+            said.clear()
+            started = time.monotonic()
+            error = None
+            try:
+                browser, page = bot.ensure_browser(p, browser, page)
+                bot.ai_command_handler(command, page, overlay)
+            except Exception as e:
+                error = type(e).__name__
+            # The handler reports most failures by saying so rather than raising
+            failed = next((text for text in said if FAILURE_SAID.search(text)), None)
+            if error is None and failed:
+                error = failed[:60]
+            stats.record(kind, time.monotonic() - started, error)
+            stats.handles[index] = len(bot.handles.live)
+    finally:
+        browser.close()
+        p.stop()
+
+def sampler(stats, stop_at, interval):
+    proc = psutil.Process() if psutil is not None else None
+    while time.monotonic() < stop_at:
+        sample = {"t": time.monotonic(), "threads": threading.active_count(),
+                  "live_handles": sum(list(stats.handles.values()))}
+        if proc is not None:
+            sample["bot_rss_mb"] = proc.memory_info().rss / 1048576
+            try:
+                sample["browser_rss_mb"] = sum(c.memory_info().rss for c in proc.children(recursive=True)) / 1048576
+            except psutil.Error:
+                pass
+        with stats.lock:
+            stats.samples.append(sample)
+        time.sleep(interval)
+
+
+# ---------------------------------------------------------------------------
+# Analysis
+# ---------------------------------------------------------------------------
+
+def percentiles(values):
+    if not values:
+        return {}
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {"count": len(values), "p50_s": round(pick(0.5), 3), "p95_s": round(pick(0.95), 3), "p99_s": round(pick(0.99), 3)}
+
+def thirds(rows, warmup):
+    """First and last third of the rows after dropping the warmup share."""
+    rows = rows[int(len(rows) * warmup):]
+    n = len(rows) // 3
+    return (rows[:n], rows[-n:]) if n else ([], [])
+
+def analyse(stats, args):
+    failures = []
+    by_kind = collections.defaultdict(list)
+    for _, kind, seconds in stats.latencies:
+        by_kind[kind].append(seconds)
+    report = {
+        "commands": len(stats.latencies),
+        "errors": dict(stats.errors),
+        "latency": percentiles([s for _, _, s in stats.latencies]),
+        "latency_by_command": {kind: percentiles(v) for kind, v in sorted(by_kind.items())},
+        "samples": stats.samples,
+    }
+
+    first, last = thirds(stats.latencies, args.warmup)
+    if first and last:
+        early, late = percentiles([s for _, _, s in first]), percentiles([s for _, _, s in last])
+        report["latency_drift"] = {"early": early, "late": late}
+        if early["p95_s"] and late["p95_s"] / early["p95_s"] > args.max_p95_drift:
+            failures.append(f"p95 latency drifted from {early['p95_s']}s to {late['p95_s']}s")
+
+    first, last = thirds(stats.samples, args.warmup)
+    growth = {}
+    for key, limit in (("bot_rss_mb", args.max_rss_growth_mb), ("browser_rss_mb", args.max_browser_growth_mb),
+                       ("threads", args.max_thread_growth), ("live_handles", args.max_handle_growth)):
+        early = [s[key] for s in first if key in s]
+        late = [s[key] for s in last if key in s]
+        if early and late:
+            growth[key] = round(statistics.median(late) - statistics.median(early), 1)
+            if growth[key] > limit:
+                failures.append(f"{key} grew by {growth[key]} (limit {limit})")
+    report["growth"] = growth
+
+    report["peak_live_handles"] = max((s["live_handles"] for s in stats.samples), default=0)
+    if not stats.latencies:
+        failures.append("no command completed")
+    report["failures"] = failures
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--duration", type=float, default=600, help="seconds to run")
+    parser.add_argument("--concurrency", type=int, default=2, help="parallel bot sessions")
+    parser.add_argument("--sample-interval", type=float, default=5)
+    parser.add_argument("--warmup", type=float, default=0.1, help="share of the run ignored for drift checks")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="fake LLM response delay in seconds")
+    parser.add_argument("--max-rss-growth-mb", type=float, default=150)
+    parser.add_argument("--max-browser-growth-mb", type=float, default=500)
+    parser.add_argument("--max-thread-growth", type=float, default=10)
+    parser.add_argument("--max-p95-drift", type=float, default=1.5, help="late/early p95 latency ratio")
+    parser.add_argument("--max-handle-growth", type=float, default=50, help="live element handles, all sessions")
+    parser.add_argument("--report", default="soak_report.json")
+    args = parser.parse_args()
+
+    site_server, site = serve(FixtureHandler)
+    FakeLLMHandler.latency = args.llm_latency
+    llm_server, llm_url = serve(FakeLLMHandler)
+    # Configure the bot before importing it: fake LLM, no audio, headless, no debug files
+    os.environ.update({
+        "TOGETHER_API_KEY": os.getenv("TOGETHER_API_KEY", "soak-test"),
+        "TOGETHER_BASE_URL": f"{llm_url}/v1",
+        "BOT_AUDIO": "0",
+        "BROWSER_HEADLESS": "1",
+        "DEBUG_CAPTURE": "0",
+        "CAPTURE_RESPONSES": os.getenv("CAPTURE_RESPONSES", "*/api/items*"),
+    })
+    import main as bot
+
+    stats = SoakStats()
+    stop_at = time.monotonic() + args.duration
+    threads = [threading.Thread(target=sampler, args=(stats, stop_at, args.sample_interval), daemon=True)]
+    threads += [threading.Thread(target=worker, args=(bot, stats, site, stop_at, i), daemon=True)
+                for i in range(args.concurrency)]
+    print(f"[Soak] {args.concurrency} sessions for {args.duration:.0f}s against {site} (LLM {llm_url})")
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    site_server.shutdown()
+    llm_server.shutdown()
+
+    report = analyse(stats, args)
+    report["llm"] = bot.llm.report()
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"[Soak] {report['commands']} commands, latency {report['latency']}")
+    for kind, summary in report["latency_by_command"].items():
+        print(f"[Soak]   {kind}: {summary}")
+    print(f"[Soak] Growth: {report['growth']}  Errors: {report['errors']}")
+    print(f"[Soak] Report written to {args.report}")
+    if report["failures"]:
+        for failure in report["failures"]:
+            print(f"[Soak] FAIL: {failure}")
+        sys.exit(1)
+    print("[Soak] PASS")
+
+if __name__ == "__main__":
+    main()